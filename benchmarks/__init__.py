@@ -0,0 +1,3 @@
+"""
+Benchmarks of the grader, run them from the repo folder with ``python -m benchmarks.<name>``.
+"""
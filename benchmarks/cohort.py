@@ -0,0 +1,345 @@
+"""
+Benchmark the end-to-end grading of a synthetic cohort.
+
+    python -m benchmarks.cohort --students 40 --jobs 4
+    python -m benchmarks.cohort --mix correct=5,loop=1 --python-runner forkserver
+    python -m benchmarks.cohort --update    # store the result as the baseline
+
+The cohort is a Canvas-style submissions.zip (name_id_submission_hw00.zip per student)
+with a mix of correct, incorrect, crashing, infinite-loop, MATLAB, notebook, misnamed
+single-file, LATE and bad-zip submissions, and .html link submissions served by a local
+HTTP server. MATLAB is replaced by fake_matlab.py, so the benchmark only needs Python.
+The example tests sleeping for 10 seconds (python_test3.py, matlab_test3.m) are excluded
+by default, see --exclude.
+
+The benchmark reports the students per second, the time spent in every phase (summed over
+the grading threads) and the peak memory of the grader and of its test processes, and it
+fails if the throughput or the memory regressed from benchmarks/baselines.json.
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+
+from benchmarks.solution import SOLUTION
+from benchmarks.startup import load_baselines, save_baselines
+from grader import Grader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KINDS = ('correct', 'incorrect', 'crash', 'loop', 'matlab', 'notebook', 'misnamed', 'late',
+         'badzip', 'link')
+DEFAULT_MIX = ('correct=8,incorrect=3,crash=2,loop=1,matlab=3,notebook=1,misnamed=1,late=1,'
+               'badzip=1,link=2')
+PHASES = ('collect_dirs', 'grade_student', 'matlab_grade', 'python_grade', 'convert_to_python',
+          'write_grades')
+TOLERANCE = 1.5
+
+def parse_mix(mix):
+    """
+    Parse the mix of submissions, 'correct=8,crash=1' -> [('correct', 8), ('crash', 1)]
+    """
+    weights = []
+    for item in mix.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in KINDS:
+            raise ValueError(f'unknown submission kind {kind!r}, expected one of {KINDS}')
+        weights.append((kind, int(weight or 1)))
+    return weights
+
+
+def notebook(code):
+    """
+    A notebook with the code in a code cell
+    """
+    return json.dumps({'cells': [{'cell_type': 'markdown', 'metadata': {}, 'source': ['# hw00']},
+                                 {'cell_type': 'code', 'execution_count': None, 'metadata': {},
+                                  'outputs': [], 'source': code.splitlines(True)}],
+                       'metadata': {}, 'nbformat': 4, 'nbformat_minor': 5})
+
+
+def zip_bytes(files):
+    """
+    Zip the files (name -> content) in memory
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for name, content in files.items():
+            zip_ref.writestr(name, content)
+    return buffer.getvalue()
+
+
+def student_files(kind, email):
+    """
+    The files of a student's submission
+    """
+    code = SOLUTION.replace('student@auburn.edu', email)
+    files = {
+        'correct': {'hw00.py': code},
+        'late': {'hw00.py': code},
+        'incorrect': {'hw00.py': code.replace('return round', 'return 1 + round')},
+        'crash': {'hw00.py': f'# {email}\nraise RuntimeError("crash")\n'},
+        'loop': {'hw00.py': f'# {email}\nwhile True:\n    pass\n'},
+        'matlab': {'hw00.m': f'% {email}\nclassdef hw00\nend\n'},
+        'notebook': {'hw00.ipynb': notebook(code)},
+        'misnamed': {'solution.py': code},
+    }[kind]
+    # the students zip a folder, with some clutter
+    return {**{f'hw00/{name}': content for name, content in files.items()},
+            '__MACOSX/hw00/._hw00': b'\0' * 64}
+
+
+def interleave(weights):
+    """
+    Spread the kinds of submissions evenly, 'a=2,b=1' -> ['a', 'b', 'a']
+    """
+    return [kind for _, kind in sorted(((j + 0.5) / weight, kind)
+                                       for kind, weight in weights for j in range(weight))]
+
+
+def write_repo(directory, name, email):
+    """
+    Write the GitHub-like archive of a link submission under directory/srv
+    """
+    repo = os.path.join(directory, 'srv', name, 'repo', 'archive', 'refs', 'heads')
+    os.makedirs(repo)
+    with open(os.path.join(repo, 'main.zip'), 'wb') as repo_file:
+        repo_file.write(zip_bytes({'repo-main/hw00.py': SOLUTION.replace('student@auburn.edu',
+                                                                          email)}))
+
+
+def make_cohort(directory, n_students, mix, base_url):
+    """
+    Generate the submission file of a cohort, and the repositories of the link submissions
+    under directory/srv
+
+    @return: The path of the submission file and the number of students of every kind
+    """
+    kinds = interleave(parse_mix(mix))
+    counts = dict.fromkeys(KINDS, 0)
+    submission_file = os.path.join(directory, 'submissions.zip')
+
+    with zipfile.ZipFile(submission_file, 'w', zipfile.ZIP_DEFLATED) as outer:
+        for i in range(n_students):
+            kind = kinds[i % len(kinds)]
+            counts[kind] += 1
+            name, student_id, email = f'student{i:04d}', 10000 + i, f'student{i}@auburn.edu'
+            stem = f'{name}_{"LATE_" if kind == "late" else ""}{student_id}_{i}_hw00'
+            if kind == 'badzip':
+                outer.writestr(stem + '.zip', b'not a zip file')
+            elif kind == 'link':
+                write_repo(directory, name, email)
+                outer.writestr(stem + '.html', f'<html><body><a href="{base_url}/{name}/repo.git">'
+                                               f'{name}</a></body></html>')
+            else:
+                outer.writestr(stem + '.zip', zip_bytes(student_files(kind, email)))
+    return submission_file, counts
+
+
+def serve(directory):
+    """
+    Serve a directory over HTTP on a free local port, in a background thread
+    """
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """
+    A file request handler without the request log
+    """
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+
+class PhaseTimer(): # pylint: disable=too-few-public-methods
+    """
+    Sum the time spent in methods of an object, over all the threads calling them.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = {}
+        self.calls = {}
+
+    def wrap(self, obj, name):
+        """
+        Time the calls of a method of obj
+        """
+        method = getattr(obj, name)
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            starting_time = time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.times[name] = self.times.get(name, 0) + time() - starting_time
+                    self.calls[name] = self.calls.get(name, 0) + 1
+        setattr(obj, name, timed)
+
+
+def peak_memory():
+    """
+    The peak RSS (in MiB) of this process and of the largest of its finished children
+    """
+    scale = 2**20 if sys.platform == 'darwin' else 2**10
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def copy_tests(test_dir, directory, exclude):
+    """
+    Copy the test files (.py and .m, as the Grader finds them), except the excluded ones,
+    to directory/tests
+    """
+    copy_dir = os.path.join(directory, 'tests')
+    os.makedirs(copy_dir)
+    for name in os.listdir(test_dir):
+        # test_dir may hold a __pycache__ or other files besides the tests
+        if name.endswith(('.py', '.m')) and name not in exclude:
+            shutil.copy(os.path.join(test_dir, name), copy_dir)
+    return copy_dir
+
+
+def run(args, directory):
+    """
+    Generate the cohort and grade it
+
+    @return: The results and the number of students of every kind
+    """
+    test_dir = copy_tests(args.test_dir, directory, args.exclude)
+    os.makedirs(os.path.join(directory, 'srv'))
+    server = serve(os.path.join(directory, 'srv'))
+    try:
+        starting_time = time()
+        submission_file, counts = make_cohort(
+            directory, args.students, args.mix, f'http://127.0.0.1:{server.server_port}')
+        generate_time = time() - starting_time
+
+        timer = PhaseTimer()
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            grader = Grader(submission_file, os.path.join(directory, 'submissions'), test_dir,
+                            wait_time=args.wait_time, jobs=args.jobs,
+                            matlab_cmd=f'{sys.executable} {os.path.join(ROOT, "fake_matlab.py")}',
+                            matlab_workers=args.matlab_workers,
+                            python_runner=args.python_runner)
+            for phase in PHASES:
+                timer.wrap(grader, phase)
+            starting_time = time()
+            grader.grade(hw_str='hw00', output_file=os.path.join(directory, 'grades.csv'))
+            grade_time = time() - starting_time
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    with open(os.path.join(directory, 'grades.csv'), 'r', encoding='utf-8') as grades_file:
+        graded = len(grades_file.readlines()) - 1
+    peak_rss = peak_memory()
+    return {'generate_time': generate_time, 'grade_time': grade_time, 'graded': graded,
+            'students_per_second': args.students / grade_time, 'phases': timer.times,
+            'calls': timer.calls, 'peak_rss_mb': peak_rss[0], 'test_peak_rss_mb': peak_rss[1]}, \
+        counts
+
+
+def report(args, results, counts):
+    """
+    Print the results
+    """
+    print('cohort        : ' + ', '.join(f'{kind} {count}' for kind, count in counts.items()
+                                         if count))
+    print(f'generated in  : {results["generate_time"]:8.2f} s')
+    print(f'graded in     : {results["grade_time"]:8.2f} s with {args.jobs} jobs '
+          f'({results["graded"]} rows in grades.csv)')
+    print(f'throughput    : {results["students_per_second"]:8.2f} students/s')
+    print(f'peak memory   : {results["peak_rss_mb"]:8.1f} MiB grader, '
+          f'{results["test_peak_rss_mb"]:.1f} MiB largest test process')
+    print('phases (summed over the grading threads):')
+    for phase in PHASES:
+        if phase in results['phases']:
+            print(f'  {phase:<18}: {results["phases"][phase]:8.2f} s '
+                  f'({results["calls"][phase]} calls)')
+
+
+def check(config, results, update):
+    """
+    Compare the results with the baseline of the same configuration, or store them
+
+    @return: True if the results regressed
+    """
+    baselines = load_baselines()
+    if update:
+        baselines['cohort'] = {'config': config,
+                               'students_per_second': round(results['students_per_second'], 3),
+                               'peak_rss_mb': round(results['peak_rss_mb'], 1)}
+        save_baselines(baselines)
+        print('Baseline stored')
+        return False
+
+    baseline = baselines.get('cohort')
+    if baseline is None or baseline['config'] != config:
+        print('No baseline for this configuration (--update stores one)')
+        return False
+    failed = False
+    if results['students_per_second'] * TOLERANCE < baseline['students_per_second']:
+        print(f'FAIL: throughput regressed (baseline {baseline["students_per_second"]:.2f} '
+              'students/s)')
+        failed = True
+    if results['peak_rss_mb'] > baseline['peak_rss_mb'] * TOLERANCE:
+        print(f'FAIL: peak memory regressed (baseline {baseline["peak_rss_mb"]:.1f} MiB)')
+        failed = True
+    if not failed:
+        print(f'baseline      : {baseline["students_per_second"]:8.2f} students/s, '
+              f'{baseline["peak_rss_mb"]:.1f} MiB')
+    return failed
+
+
+def main():
+    """
+    Entry point
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=40)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'weights of {", ".join(KINDS)}')
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--wait-time', type=int, default=5)
+    parser.add_argument('--python-runner', default='subprocess')
+    parser.add_argument('--matlab-workers', type=int, default=0)
+    parser.add_argument('--test-dir', default=os.path.join(ROOT, 'tests'))
+    parser.add_argument('--exclude', nargs='*', default=['python_test3.py', 'matlab_test3.m'])
+    parser.add_argument('--keep', action='store_true', help='keep the generated files')
+    parser.add_argument('--verbose', action='store_true', help='show the grader output')
+    parser.add_argument('--update', action='store_true', help='store the baseline')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='grader_cohort_')
+    try:
+        results, counts = run(args, directory)
+    finally:
+        if args.keep:
+            print(f'Generated files kept in {directory}')
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report(args, results, counts)
+    config = {'students': args.students, 'mix': args.mix, 'jobs': args.jobs,
+              'wait_time': args.wait_time, 'python_runner': args.python_runner,
+              'matlab_workers': args.matlab_workers, 'exclude': sorted(args.exclude)}
+    sys.exit(1 if check(config, results, args.update) else 0)
+
+
+if __name__ == '__main__':
+    main()
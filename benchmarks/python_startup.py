@@ -0,0 +1,78 @@
+"""
+Compare the Python test startup cost of one interpreter per test with the fork-server.
+
+    python -m benchmarks.python_startup --repeat 5
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from time import time
+
+from python_runner import ForkServer
+from utility import execute_system_call
+from benchmarks.solution import SOLUTION
+
+# python_test3 sleeps for 10 seconds, it only measures the sleep
+TESTS = ['python_test1.py', 'python_test2_small.py', 'python_test2_large.py']
+
+def make_student(test_dir):
+    """
+    Create a student's directory with the reference solution and the test files
+    """
+    student_path = tempfile.mkdtemp(prefix='grader_bench_')
+    with open(os.path.join(student_path, 'hw00.py'), 'w', encoding='utf-8') as code_file:
+        code_file.write(SOLUTION)
+    for _test in TESTS:
+        shutil.copy(os.path.join(test_dir, _test), student_path)
+    return student_path
+
+
+def bench(run, student_path, repeat):
+    """
+    Run every test repeat times, return the mean time per test and the outputs
+    """
+    outputs = set()
+    starting_time = time()
+    for _ in range(repeat):
+        for _test in TESTS:
+            outputs.add(run(student_path, os.path.join(student_path, _test)))
+    return (time() - starting_time) / (repeat * len(TESTS)), outputs
+
+
+def main():
+    """
+    Entry point
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--test-dir', default='tests')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    student_path = make_student(args.test_dir)
+    try:
+        subprocess_time, subprocess_out = bench(
+            lambda student, test: execute_system_call([sys.executable, test]),
+            student_path, args.repeat)
+
+        starting_time = time()
+        with ForkServer() as server:
+            server_start = time() - starting_time
+            fork_time, fork_out = bench(server.run, student_path, args.repeat)
+    finally:
+        shutil.rmtree(student_path)
+
+    print(f'tests per runner          : {args.repeat * len(TESTS)}')
+    print(f'subprocess   per test     : {subprocess_time * 1000:8.1f} ms')
+    print(f'fork-server  per test     : {fork_time * 1000:8.1f} ms')
+    print(f'fork-server  startup      : {server_start * 1000:8.1f} ms (once per run)')
+    print(f'saved        per test     : {(subprocess_time - fork_time) * 1000:8.1f} ms '
+          f'({subprocess_time / fork_time:.1f}x)')
+    if subprocess_out != fork_out:
+        print(f'WARNING: the outputs differ\n{subprocess_out}\n{fork_out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark the similarity check on synthetic submissions.
+
+    python -m benchmarks.similarity --sizes 1000 5000 20000
+    python -m benchmarks.similarity --sizes 1000 --legacy   # also time the pairwise loop
+"""
+
+import argparse
+from time import time
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from utility import similar_pairs
+
+def make_documents(n_documents, seed=0, vocabulary=2000, length=300, copies=0.05):
+    """
+    Generate synthetic submissions, a fraction of them are edited copies of others
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array([f'tok{i}' for i in range(vocabulary)])
+    # Zipf-like word frequencies, like code tokens
+    weights = 1.0 / np.arange(1, vocabulary + 1)
+    weights /= weights.sum()
+    documents = [' '.join(rng.choice(words, length, p=weights)) for _ in range(n_documents)]
+    for i in rng.choice(n_documents, int(copies * n_documents), replace=False):
+        source = documents[rng.integers(n_documents)].split()
+        edits = rng.choice(len(source), length // 10, replace=False)
+        for j in edits:
+            source[j] = rng.choice(words)
+        documents[i] = ' '.join(source)
+    return documents
+
+
+def legacy_pairs(tfidf, threshold):
+    """
+    The former element by element double loop
+    """
+    pairwise_similarity = tfidf * tfidf.T
+    pairs = 0
+    for i in range(tfidf.shape[0]):
+        for j in range(tfidf.shape[0]):
+            if i > j and pairwise_similarity[i, j] > threshold:
+                pairs += 1
+    return pairs
+
+
+def main():
+    """
+    Entry point
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--threshold', type=float, default=0.92)
+    parser.add_argument('--top-k', type=int, default=None)
+    parser.add_argument('--block-size', type=int, default=256)
+    parser.add_argument('--legacy', action='store_true', help='also time the former loop')
+    args = parser.parse_args()
+
+    print(f'{"documents":>10} {"tf-idf":>10} {"pairs":>10} {"found":>8} {"legacy":>10}')
+    for size in args.sizes:
+        documents = make_documents(size)
+
+        starting_time = time()
+        tfidf = TfidfVectorizer().fit_transform(documents)
+        tfidf_time = time() - starting_time
+
+        starting_time = time()
+        firsts, _, _ = similar_pairs(tfidf, args.threshold, args.top_k, args.block_size)
+        pairs_time = time() - starting_time
+
+        legacy = ''
+        if args.legacy:
+            starting_time = time()
+            legacy_pairs(tfidf, args.threshold)
+            legacy = f'{time() - starting_time:9.2f}s'
+
+        print(f'{size:>10} {tfidf_time:9.2f}s {pairs_time:9.2f}s {len(firsts):>8} {legacy:>10}')
+
+
+if __name__ == '__main__':
+    main()
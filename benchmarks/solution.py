@@ -0,0 +1,24 @@
+"""
+Reference solution of the example tests, used as the student's code in the benchmarks.
+"""
+
+SOLUTION = '''# student@auburn.edu
+import time
+import numpy as np
+
+def p1(n):
+    if n == 0:
+        return 0
+    if n <= 2:
+        return 1
+    a, b, c = 0, 1, 1
+    for _ in range(n - 2):
+        a, b, c = b, c, a + b + c
+    return c
+
+def p2(A):
+    return round(np.linalg.det(A))
+
+def p3():
+    time.sleep(1.0)
+'''
@@ -0,0 +1,97 @@
+"""
+Measure the time of ``import grader`` and fail if it regressed.
+
+    python -m benchmarks.startup            # compare with benchmarks/baselines.json
+    python -m benchmarks.startup --update   # store the current time as the baseline
+
+The check also fails if importing the grader loads one of the similarity or reporting
+dependencies, which must only be imported by the code paths using them.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+LAZY_MODULES = ('sklearn', 'pandas', 'networkx', 'bs4', 'requests')
+TOLERANCE = 1.5
+SLACK = 0.05
+
+PROBE = f"""
+import sys, time
+starting_time = time.perf_counter()
+import grader
+print(time.perf_counter() - starting_time)
+print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))
+"""
+
+def measure(repeat):
+    """
+    Import the grader in fresh interpreters, return the median time and the loaded modules
+    """
+    times, loaded = [], set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True,
+                                check=True).stdout.splitlines()
+        times.append(float(output[0]))
+        loaded.update(output[1].split() if len(output) > 1 else [])
+    return statistics.median(times), loaded
+
+
+def load_baselines():
+    """
+    Load the stored baselines
+    """
+    if not os.path.exists(BASELINES):
+        return {}
+    with open(BASELINES, 'r', encoding='utf-8') as baselines_file:
+        return json.load(baselines_file)
+
+
+def save_baselines(baselines):
+    """
+    Store the baselines
+    """
+    with open(BASELINES, 'w', encoding='utf-8') as baselines_file:
+        json.dump(baselines, baselines_file, indent=2, sort_keys=True)
+        baselines_file.write('\n')
+
+
+def main():
+    """
+    Entry point
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--update', action='store_true', help='store the baseline')
+    args = parser.parse_args()
+
+    import_time, loaded = measure(args.repeat)
+    baselines = load_baselines()
+    print(f'import grader: {import_time * 1000:.1f} ms (median of {args.repeat})')
+
+    if args.update:
+        baselines['import_grader'] = round(import_time, 4)
+        save_baselines(baselines)
+        print(f'Baseline stored in {BASELINES}')
+        return
+
+    failed = False
+    if loaded:
+        print(f'FAIL: import grader loads {", ".join(sorted(loaded))}')
+        failed = True
+    if 'import_grader' in baselines:
+        limit = baselines['import_grader'] * TOLERANCE + SLACK
+        print(f'baseline: {baselines["import_grader"] * 1000:.1f} ms, limit: {limit * 1000:.1f} ms')
+        if import_time > limit:
+            print('FAIL: import grader regressed')
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
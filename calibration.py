@@ -0,0 +1,69 @@
+"""
+Per-test timeouts calibrated from the runtime of a reference solution, stored next to the
+tests in timeouts.json.
+"""
+
+import json
+import os
+
+from result_cache import hash_files
+
+TIMEOUTS_FILE = 'timeouts.json'
+
+def test_timeout(runtime, multiplier=5.0, floor=5.0, ceiling=60.0):
+    """
+    The timeout of a test: the runtime of the reference solution times the multiplier,
+    clamped between the floor and the ceiling
+    """
+    return min(ceiling, max(floor, runtime * multiplier))
+
+
+def test_hash(test_dir, test):
+    """
+    The hash of a test file, a calibration is only valid for the test it measured
+    """
+    return hash_files([(test, os.path.join(test_dir, test))]).hexdigest()
+
+
+def save_timeouts(test_dir, runtimes, multiplier=5.0, floor=5.0, ceiling=60.0):
+    """
+    Compute the timeouts of the tests and write them to test_dir/timeouts.json
+
+    @param test_dir: The test directory
+    @param runtimes: The runtime of the reference solution (in seconds) of every test
+    @return: The timeout of every test
+    """
+    tests = {test: {'runtime': round(runtime, 3),
+                    'timeout': round(test_timeout(runtime, multiplier, floor, ceiling), 3),
+                    'hash': test_hash(test_dir, test)}
+             for test, runtime in sorted(runtimes.items())}
+    with open(os.path.join(test_dir, TIMEOUTS_FILE), 'w', encoding='utf-8') as timeouts_file:
+        json.dump({'multiplier': multiplier, 'floor': floor, 'ceiling': ceiling,
+                   'tests': tests}, timeouts_file, indent=2)
+        timeouts_file.write('\n')
+    return {test: entry['timeout'] for test, entry in tests.items()}
+
+
+def load_timeouts(test_dir):
+    """
+    Load the calibrated timeouts of the tests, the tests changed since their calibration
+    are left out (they use the flat wait time)
+
+    @param test_dir: The test directory
+    @return: The timeout of every calibrated test, {} without timeouts.json
+    """
+    try:
+        with open(os.path.join(test_dir, TIMEOUTS_FILE), 'r', encoding='utf-8') as timeouts_file:
+            tests = json.load(timeouts_file)['tests']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+    timeouts = {}
+    for test, entry in tests.items():
+        if not os.path.isfile(os.path.join(test_dir, test)):
+            continue
+        if entry.get('hash') != test_hash(test_dir, test):
+            print(f'{test} changed since its calibration, it uses the flat wait time\n')
+            continue
+        timeouts[test] = float(entry['timeout'])
+    return timeouts
@@ -0,0 +1,117 @@
+"""
+Concurrent downloads of the link submissions through a pooled HTTP session.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import Tracer
+
+CHUNK_SIZE = 1 << 16
+
+class Downloader(): # pylint: disable=too-many-instance-attributes
+    """
+    Download files concurrently through a shared session. Failed requests are retried with
+    an exponential backoff, and the ETag/Last-Modified of every download is kept next to the
+    file, so an unchanged file is not fetched again.
+    """
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(self, max_workers=8, timeout=10, retries=3, backoff=0.5, tracer=None):
+        self.max_workers = max_workers
+        # the downloads are traced as 'download' spans (see tracing.py)
+        self.tracer = tracer if tracer is not None else Tracer(enabled=False)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.session = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get_session(self):
+        """
+        Get the shared session, requests is only imported when there is something to download
+        """
+        # pylint: disable=import-outside-toplevel
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        with self.lock:
+            if self.session is None:
+                retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                              status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=['GET'])
+                adapter = HTTPAdapter(pool_connections=self.max_workers,
+                                      pool_maxsize=self.max_workers, max_retries=retry)
+                self.session = requests.Session()
+                self.session.mount('http://', adapter)
+                self.session.mount('https://', adapter)
+            return self.session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, url, path):
+        """
+        Download a file in the background
+
+        @param url: The URL
+        @param path: The destination file
+        @return: The future of the destination file
+        """
+        return self.executor.submit(self.traced_download, url, path)
+
+    def traced_download(self, url, path):
+        """
+        download, in a 'download' span of the tracer
+        """
+        with self.tracer.span('download', url=url):
+            return self.download(url, path)
+
+    def download(self, url, path):
+        """
+        Download a file, unless the server reports that the local copy is up to date
+
+        @param url: The URL
+        @param path: The destination file
+        @return: The destination file
+        """
+        meta_path = path + '.meta'
+        headers = {}
+        if os.path.exists(path) and os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            if meta.get('url') == url:
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
+
+        with self.get_session().get(url, headers=headers, stream=True, allow_redirects=True,
+                              timeout=self.timeout) as response:
+            if response.status_code == 304:
+                return path
+            response.raise_for_status()
+            with open(path + '.part', 'wb') as part_file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    part_file.write(chunk)
+            os.replace(path + '.part', path)
+
+            with open(meta_path, 'w', encoding='utf-8') as meta_file:
+                json.dump({'url': url,
+                           'etag': response.headers.get('ETag'),
+                           'last_modified': response.headers.get('Last-Modified')}, meta_file)
+        return path
+
+    def close(self):
+        """
+        Wait for the downloads and close the session
+        """
+        self.executor.shutdown()
+        if self.session is not None:
+            self.session.close()
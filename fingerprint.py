@@ -0,0 +1,173 @@
+"""
+Normalized token fingerprints of the submissions for the similarity check.
+
+The code is tokenized, the identifiers, numbers and strings are replaced by placeholders
+(so renaming variables or changing constants does not hide copying), the comments and the
+layout are dropped (so reformatting does not either), and the k-grams of tokens are
+winnowed to a set of fingerprints, which does not depend on the order of the functions.
+"""
+
+import builtins
+import hashlib
+import io
+import json
+import keyword
+import os
+import re
+import tokenize
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from result_cache import ResultCache
+
+FINGERPRINT_VERSION = 1
+
+# the names kept as they are, renaming them changes the meaning of the code
+PYTHON_NAMES = set(keyword.kwlist) | set(dir(builtins)) | {'np', 'numpy', 'math'}
+MATLAB_NAMES = {
+    'break', 'case', 'catch', 'classdef', 'continue', 'else', 'elseif', 'end', 'for',
+    'function', 'global', 'if', 'otherwise', 'parfor', 'persistent', 'return', 'switch',
+    'try', 'while', 'abs', 'disp', 'error', 'exp', 'eye', 'fprintf', 'length', 'log',
+    'max', 'min', 'numel', 'ones', 'size', 'sqrt', 'sum', 'zeros'}
+
+MATLAB_TOKEN = re.compile(r"""
+    (?P<block>^\s*%\{.*?^\s*%\}\s*$)        # block comment
+  | (?P<comment>(?:%|\.\.\.)[^\n]*)         # comment, line continuation
+  | (?P<string>"(?:[^"\n]|"")*"|(?<![\w)\]}.'])'(?:[^'\n]|'')*')   # not a transpose
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?[ij]?)
+  | (?P<name>[A-Za-z]\w*)
+  | (?P<op>\.\^|\.\*|\./|\.\\|\.'|==|~=|<=|>=|&&|\|\||[^\s\w])
+""", re.VERBOSE | re.MULTILINE | re.DOTALL)
+
+def python_tokens(text):
+    """
+    Tokenize Python code to normalized tokens
+    """
+    tokens = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(text).readline):
+            if token.type == tokenize.NAME:
+                tokens.append(token.string if token.string in PYTHON_NAMES else 'V')
+            elif token.type == tokenize.NUMBER:
+                tokens.append('N')
+            elif token.type == tokenize.STRING:
+                tokens.append('S')
+            elif token.type == tokenize.OP:
+                tokens.append(token.string)
+            elif token.type == tokenize.NEWLINE:
+                tokens.append(';')
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # code that does not tokenize (a notebook dump, a syntax error) is still compared
+        tokens = matlab_tokens(text)
+    return tokens
+
+
+def matlab_tokens(text):
+    """
+    Tokenize MATLAB code to normalized tokens
+    """
+    tokens = []
+    for match in MATLAB_TOKEN.finditer(text):
+        kind = match.lastgroup
+        if kind == 'name':
+            tokens.append(match.group() if match.group() in MATLAB_NAMES else 'V')
+        elif kind == 'number':
+            tokens.append('N')
+        elif kind == 'string':
+            tokens.append('S')
+        elif kind == 'op':
+            tokens.append(match.group())
+    return tokens
+
+
+def winnow(tokens, k=5, window=4):
+    """
+    Winnow the hashes of the k-grams of tokens: the minimum hash of every window of
+    window consecutive k-grams is a fingerprint
+
+    @return: The sorted fingerprints
+    """
+    if len(tokens) < k:
+        tokens = tokens + [''] * (k - len(tokens))
+    hashes = np.array([zlib.crc32(' '.join(tokens[i:i + k]).encode('utf-8'))
+                       for i in range(len(tokens) - k + 1)], dtype=np.int64)
+    if len(hashes) > window:
+        hashes = np.lib.stride_tricks.sliding_window_view(hashes, window).min(axis=1)
+    return np.unique(hashes)
+
+
+def fingerprint(text, language, k=5, window=4):
+    """
+    Compute the fingerprints of a file
+
+    @param text: The code
+    @param language: 'matlab' or 'python'
+    @return: The sorted fingerprints
+    """
+    tokens = python_tokens(text) if language == 'python' else matlab_tokens(text)
+    return winnow(tokens, k, window)
+
+
+def _fingerprint_list(args):
+    """
+    fingerprint for a process pool, as a list
+    """
+    return fingerprint(*args).tolist()
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def fingerprint_documents(documents, language, cache_dir=None, jobs=None, k=5, window=4):
+    """
+    Compute the fingerprints of the documents in parallel, the fingerprints of every
+    document are cached by its content, so only the new or changed documents are processed
+
+    @param documents: The code of the documents
+    @param language: 'matlab' or 'python'
+    @param cache_dir: The cache directory (None to disable the cache)
+    @param jobs: The number of processes (None for the number of CPUs)
+    @return: The fingerprints of every document
+    """
+    cache = ResultCache(cache_dir) if cache_dir else None
+    config = json.dumps([FINGERPRINT_VERSION, language, k, window]).encode('utf-8')
+    keys = [hashlib.sha256(config + b'\0' + text.encode('utf-8')).hexdigest()
+            for text in documents]
+
+    fingerprints = [cache.get(key) if cache else None for key in keys]
+    missing = [i for i, cached in enumerate(fingerprints) if cached is None]
+    if len(missing) > 1 and jobs != 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            computed = list(executor.map(
+                _fingerprint_list, [(documents[i], language, k, window) for i in missing],
+                chunksize=max(1, len(missing) // (4 * (jobs or os.cpu_count() or 1)))))
+    else:
+        computed = [_fingerprint_list((documents[i], language, k, window)) for i in missing]
+
+    for i, values in zip(missing, computed):
+        fingerprints[i] = values
+        if cache:
+            cache.put(keys[i], values)
+    return [np.array(values, dtype=np.int64) for values in fingerprints]
+
+
+def fingerprint_vectors(fingerprints, template=()):
+    """
+    Build the L2-normalized binary vectors of the fingerprints (one row per document), the
+    fingerprints of the template code are removed, so that the code given to every student
+    does not count as similar
+
+    @param fingerprints: The fingerprints of every document
+    @param template: The fingerprints of the template code
+    @return: The sparse vectors, their dot products are the cosine similarities of the sets
+    """
+    from scipy.sparse import csr_matrix # pylint: disable=import-outside-toplevel
+
+    template = np.asarray(template, dtype=np.int64)
+    fingerprints = [values[~np.isin(values, template)] for values in fingerprints]
+    values, columns = np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] + fingerprints),
+                                return_inverse=True)
+    lengths = np.array([len(document) for document in fingerprints], dtype=np.int64)
+    data = np.repeat(1.0 / np.sqrt(np.maximum(lengths, 1)), lengths)
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    return csr_matrix((data, columns.ravel(), indptr), shape=(len(fingerprints), len(values)))
@@ -3,27 +3,79 @@ Grader class that grades students with matlab tests or python tests.
 """
 
 import os
+import shlex
 import shutil
+import sys
+import threading
 import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
 from time import time
 
-import requests
-
-from utility import execute_system_call, find_emails, extract_link, unzip, remove_duplicates
+from calibration import load_timeouts, save_timeouts
+from downloader import Downloader
+from journal import GradingJournal
+from language import detect_language
+from matlab_pool import MatlabPool, matlab_quote, matlab_run
+from notebook import convert_notebook
+from python_runner import ForkServer, run_batch, RUN_TEST
+from result_cache import ResultCache
+from results import ResultTable
+from scheduler import EXCLUSIVE, SHARED, Scheduler, read_schedule
+from submissions import SubmissionArchive, extract_relevant, remove_test_copies, \
+    CODE_EXTENSIONS, EXTRA_EXTENSIONS, MAX_FILE_SIZE
+from tracing import Tracer
+from utility import execute_system_call, expected_markers, find_emails, extract_link, \
+    link_or_copy, python_path, read_only
 
 NULL_EMAIL = 'null___@null__.___'
 
-class Grader():
+class Grader(): # pylint: disable=too-many-instance-attributes
     """
     Grader class that grades students with matlab tests or python tests.
     """
-    def __init__(self, submission_file, submission_dir, test_dir, wait_time=30):
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments,too-many-locals
+    def __init__(self, submission_file, submission_dir, test_dir, wait_time=30, jobs=1,
+                 matlab_cmd='matlab', matlab_workers=0, python_runner='subprocess',
+                 cache_dir=None, force=False, download_workers=8,
+                 extensions=CODE_EXTENSIONS + EXTRA_EXTENSIONS, max_file_size=MAX_FILE_SIZE,
+                 limits=None, scratch_dir=None):
         self.total_students = -1
         self.submission_file = submission_file
         self.submission_dir = submission_dir
         self.test_dir = test_dir
         self.wait_time = wait_time
+        self.jobs = max(1, jobs)
+        # matlab_workers > 0 runs the MATLAB tests in a pool of persistent MATLAB workers
+        self.matlab_cmd = matlab_cmd
+        self.matlab_workers = matlab_workers
+        self.matlab_pool = None
+        # python_runner='forkserver' forks the Python tests from a server with numpy preloaded,
+        # 'batch' runs all the tests of a student in one process importing the student's code once
+        if python_runner in ('forkserver', 'batch') and not hasattr(os, 'fork'):
+            raise ValueError(f"python_runner='{python_runner}' needs os.fork (Linux/macOS), "
+                             "use python_runner='subprocess'")
+        self.python_runner = python_runner
+        self.fork_server = None
+        # cache_dir keeps the results of unchanged submissions, force=True regrades everyone
+        self.cache = ResultCache(cache_dir) if cache_dir is not None else None
+        self.force = force
+        # the number of concurrent downloads of the link submissions
+        self.download_workers = download_workers
+        # only the files with these extensions (and at most max_file_size bytes) are extracted
+        self.extensions = extensions
+        self.max_file_size = max_file_size
+        self.archive = None
+        # the resource limits of every test: {'memory': bytes of address space, 'cpu': seconds,
+        # 'files': open files, 'processes': processes of the user}, see utility.resource_limits
+        self.limits = limits
+        # the students are graded in scratch_dir/<student> (e.g. on a tmpfs, /dev/shm/grader),
+        # removed once graded, instead of submission_dir/<student>
+        self.scratch_dir = scratch_dir
+        # the typed results of the graded students, see results.py
+        self.results = ResultTable()
+        # the spans of the grading phases, recorded when grade() is given a trace_file
+        self.tracer = Tracer(enabled=False)
 
         self.matlab_test = []
         self.python_test = []
@@ -38,34 +90,137 @@ class Grader():
         print(f"MATLAB test {self.matlab_test} found!\n")
         print(f"PYTHON test {self.python_test} found!\n")
 
+        # the tests declaring schedule=exclusive (timing-sensitive) run alone, see scheduler.py
+        self.schedules = {_test: read_schedule(os.path.join(test_dir, _test))
+                          for _test in self.matlab_test + self.python_test}
+        self.scheduler = Scheduler()
+        exclusive = [_test for _test, schedule in self.schedules.items() if schedule == EXCLUSIVE]
+        if exclusive:
+            print(f"Tests run alone: {exclusive}\n")
+
+        # the timeouts calibrated from a reference solution (see calibrate), by test
+        self.timeouts = load_timeouts(test_dir)
+        if self.timeouts:
+            print(f"Calibrated timeouts: {self.timeouts}\n")
+
         print('==============  Grader initialized! =============\n\n')
 
-    def get_dirs(self):
+    def collect_dirs(self, downloader, archive=None):
         """
-        Get the student directories
+        Get the student zip files, the link submissions are downloaded in the background
+
+        @param downloader: The downloader
+        @param archive: The submission file read in place (None if it is extracted on disk)
+        @return: The student zip files mapped to their source: None for a local zip file,
+            the download of the zip file, or the member of the submission file
         """
-        student_dirs = set()
+        student_dirs = {}
+
+        if archive is not None:
+            for member in archive.members('.zip'):
+                student_dirs[os.path.join(self.submission_dir, os.path.basename(member))] = member
 
         for student in os.listdir(self.submission_dir):
             student_dir = os.path.join(self.submission_dir, student)
             if student_dir.endswith('.zip'):
-                student_dirs.add(student_dir)
+                student_dirs.setdefault(student_dir, None)
             if student_dir.endswith('.html'):
                 zip_link = extract_link(student_dir) + '/archive/refs/heads/main.zip'
-                req = requests.get(zip_link, allow_redirects=True, timeout=10)
-                with open(
-                    f'{os.path.join(self.submission_dir, Path(student_dir).stem)}.zip'\
-                        , 'wb') as f_in:
-                    f_in.write(req.content)
-                student_dirs.add(f'{os.path.join(self.submission_dir, Path(student_dir).stem)}.zip')
+                zip_file = f'{os.path.join(self.submission_dir, Path(student_dir).stem)}.zip'
+                student_dirs[zip_file] = downloader.submit(zip_link, zip_file)
         return student_dirs
 
-    def matlab_grade(self, student_path, hw_str='hw00'):
+    def get_dirs(self):
+        """
+        Get the student directories
+        """
+        with Downloader(self.download_workers) as downloader:
+            student_dirs = self.collect_dirs(downloader)
+            for source in student_dirs.values():
+                if source is not None:
+                    source.result()
+        return set(student_dirs)
+
+    def test_wait(self, test):
+        """
+        The maximum wait time of a test: its calibrated timeout, or wait_time
+        """
+        return self.timeouts.get(test, self.wait_time)
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def calibrate(self, reference_dir, hw_str='hw00', multiplier=5.0, floor=5.0, ceiling=None,
+                  runs=3):
+        """
+        Run the reference solution against every test, and store the timeouts of the tests
+        (the slowest runtime times the multiplier, clamped between the floor and the ceiling)
+        in test_dir/timeouts.json. The tests are run one at a time, as processes (the
+        MATLAB startup is included).
+
+        @param reference_dir: The directory of the reference solution (hw_str.m, hw_str.py)
+        @param hw_str: The homework string
+        @param multiplier: The timeout of a test is its runtime times the multiplier
+        @param floor: The minimum timeout (in seconds)
+        @param ceiling: The maximum timeout (defaults to wait_time)
+        @param runs: The number of runs of every test
+        @return: The timeout of every test
+        """
+        ceiling = self.wait_time if ceiling is None else ceiling
+        runtimes = {}
+        for extension, tests in (('.m', self.matlab_test), ('.py', self.python_test)):
+            if os.path.exists(os.path.join(reference_dir, hw_str + extension)):
+                for _test in tests:
+                    runtimes[_test] = self._reference_runtime(reference_dir, _test, runs, ceiling)
+
+        self.timeouts = save_timeouts(self.test_dir, runtimes, multiplier, floor, ceiling)
+        print(f"\nCalibrated timeouts saved in {os.path.join(self.test_dir, 'timeouts.json')}: "
+              f"{self.timeouts}\n")
+        return self.timeouts
+
+    def _reference_runtime(self, reference_dir, _test, runs, max_wait):
+        """
+        The slowest runtime of a test run against the reference solution (see calibrate)
+        """
+        runtime = 0
+        for _ in range(runs):
+            starting_time = time()
+            output = execute_system_call(
+                **self.test_command(reference_dir, _test), max_wait=max_wait,
+                limits=self.limits, expected=expected_markers(os.path.join(self.test_dir, _test)))
+            runtime = max(runtime, time() - starting_time)
+        if 'FAIL' in output or '{{' in output:
+            print(f'The reference solution does not pass {_test}: {output}\n')
+        print(f'{_test}: {runtime:.2f} sec')
+        return runtime
+
+    def test_command(self, student_path, _test):
+        """
+        The command running a test in place from the test directory, in the student's
+        directory and importing the student's code first (nothing is copied), before the
+        modules of the test directory
+
+        @param student_path: The student's directory
+        @param _test: The test file name
+        @return: The command, cwd and env arguments of execute_system_call
+        """
+        test_path = os.path.abspath(os.path.join(self.test_dir, _test))
+        student_path = os.path.abspath(student_path)
+        if _test.endswith('.m'):
+            return {'command': shlex.split(self.matlab_cmd) +
+                               ['-nojvm', '-nosplash', '-nodesktop', '-batch',
+                                f'cd({matlab_quote(student_path)}); {matlab_run(test_path)}; '
+                                'exit;'],
+                    'cwd': student_path, 'env': None}
+        return {'command': ['python', '-c', RUN_TEST, test_path], 'cwd': student_path,
+                'env': python_path(student_path)}
+
+    def matlab_grade(self, student_path, hw_str='hw00', cancel=None):
         """
         Grade the student's MATLAB code
 
         @param student_path: The student's directory
         @param hw_str: The homework string
+        @param cancel: A threading.Event, set to stop grading (the running test is killed and
+            the remaining tests are skipped)
         """
         with open(os.path.join(student_path, hw_str + '.m'), 'r',\
                    encoding='utf-8', errors='ignore') as code_file:
@@ -73,24 +228,38 @@ class Grader():
             email = ' '.join(find_emails(code_file.readlines()[0]))
             if email.find('@')== -1:
                 email = NULL_EMAIL
-            # copy the test file to the student's directory
+            # run the test files in place (see test_command)
+            outputs = []
+            usage = []
             for _test in self.matlab_test:
-                shutil.copy(os.path.join(self.test_dir, _test), student_path)
-            # run the test file
-            student_score = ""
-            for _test in self.matlab_test:
-                student_score += execute_system_call(\
-                        f'matlab -nojvm -nosplash -nodesktop -batch \
-                        "run(\'{os.path.join(student_path, _test)}\');exit;"',
-                        max_wait=self.wait_time)
-            return student_score.count('PASS'), email, student_score
-
-    def python_grade(self, student_path, hw_str='hw00'):
+                if cancel is not None and cancel.is_set():
+                    break
+                expected = expected_markers(os.path.join(self.test_dir, _test))
+                with self.scheduler.run(self.schedules[_test]), \
+                        self.tracer.span('matlab_test', student=os.path.basename(student_path),
+                                         test=_test):
+                    if self.matlab_pool is not None:
+                        outputs.append(self.matlab_pool.run(
+                            student_path, os.path.join(self.test_dir, _test),
+                            max_wait=self.test_wait(_test), expected=expected, usage=usage,
+                            cancel=cancel))
+                        continue
+                    outputs.append(execute_system_call(
+                            **self.test_command(student_path, _test),
+                            max_wait=self.test_wait(_test), expected=expected,
+                            limits=self.limits, usage=usage, cancel=cancel))
+            student_score = ''.join(outputs)
+            return student_score.count('PASS'), email, student_score, \
+                list(zip(self.matlab_test, outputs, usage))
+
+    def python_grade(self, student_path, hw_str='hw00', cancel=None):
         """
         Grade the student's Python code
 
         @param student_path: The student's directory
         @param hw_str: The homework string
+        @param cancel: A threading.Event, set to stop grading (the running test or batch is
+            killed and the remaining tests are skipped)
         """
         with open(os.path.join(student_path, hw_str + '.py'), 'r', \
                   encoding='utf-8', errors='ignore') as code_file:
@@ -98,32 +267,120 @@ class Grader():
             email = ' '.join(find_emails(code_file.readlines()[0]))
             if email.find('@')== -1:
                 email = NULL_EMAIL
-            # copy the test file to the student's directory
-            for _test in self.python_test:
-                shutil.copy(os.path.join(self.test_dir, _test), student_path)
-            # run the test file
-            student_score = ""
-            for _test in self.python_test:
-                student_score += execute_system_call(\
-                        f'python \"{os.path.join(student_path, _test)}\"',
-                        max_wait=self.wait_time)
-            return student_score.count('PASS'), email, student_score
+            # run the test files in place (see test_command)
+            outputs = []
+            usage = []
+            tests = self.python_test
+            if self.python_runner == 'batch':
+                # the exclusive tests run in their own batch
+                results = {}
+                for schedule in (SHARED, EXCLUSIVE):
+                    batch = [_test for _test in self.python_test
+                             if self.schedules[_test] == schedule]
+                    if not batch:
+                        continue
+                    if cancel is not None and cancel.is_set():
+                        break
+                    with self.scheduler.run(schedule), \
+                            self.tracer.span('python_batch', test=batch,
+                                             student=os.path.basename(student_path)):
+                        results.update(zip(batch, run_batch(
+                            student_path,
+                            [(os.path.join(self.test_dir, _test),
+                              expected_markers(os.path.join(self.test_dir, _test)),
+                              self.test_wait(_test))
+                             for _test in batch],
+                            max_wait=max(self.test_wait(_test) for _test in batch),
+                            limits=self.limits, module=hw_str, cancel=cancel)))
+                # the tests of a cancelled grading are not all run
+                tests = [_test for _test in self.python_test if _test in results]
+                for _test in tests:
+                    outputs.append(results[_test][0])
+                    usage.append(results[_test][1])
+            else:
+                for _test in self.python_test:
+                    if cancel is not None and cancel.is_set():
+                        break
+                    expected = expected_markers(os.path.join(self.test_dir, _test))
+                    with self.scheduler.run(self.schedules[_test]), \
+                            self.tracer.span('python_test', test=_test,
+                                             student=os.path.basename(student_path)):
+                        if self.fork_server is not None:
+                            outputs.append(self.fork_server.run(
+                                student_path, os.path.join(self.test_dir, _test),
+                                max_wait=self.test_wait(_test), expected=expected,
+                                usage=usage, cancel=cancel))
+                            continue
+                        outputs.append(execute_system_call(
+                                **self.test_command(student_path, _test),
+                                max_wait=self.test_wait(_test), expected=expected,
+                                limits=self.limits, usage=usage, cancel=cancel))
+            student_score = ''.join(outputs)
+            return student_score.count('PASS'), email, student_score, \
+                list(zip(tests, outputs, usage))
 
     def convert_to_python(self, student_path, hw_str='hw00'):
         """
-        Convert the student's Jupyter notebook to Python script
+        Convert the student's Jupyter notebook to Python script, in process (see notebook.py)
 
         @param student_path: The student's directory
         @param hw_str: The homework string
+        @return: False if the notebook is not valid
         """
-        execute_system_call(f'jupyter nbconvert --to python\
-                             {os.path.join(student_path, hw_str + ".ipynb")}',
-                            max_wait=self.wait_time)
+        with self.tracer.span('convert_notebook', student=os.path.basename(student_path)):
+            return convert_notebook(os.path.join(student_path, hw_str + '.ipynb'),
+                                    os.path.join(student_path, hw_str + '.py'), self.cache)
+
+    def cache_key(self, hw_str, student_dir, runner):
+        """
+        Compute the cache key of a grading, None if the cache is disabled
+
+        @param hw_str: The homework string
+        @param student_dir: The student directory
+        @param runner: The language runner ('matlab', 'python'), the key also depends on
+            the runner configuration (MATLAB command, Python runner and interpreter)
+        """
+        if self.cache is None:
+            return None
+        test_paths = [os.path.join(self.test_dir, _test)
+                      for _test in self.matlab_test + self.python_test]
+        with self.tracer.span('cache_key', student=os.path.basename(student_dir)):
+            return self.cache.key(student_dir, test_paths, hw_str=hw_str, runner=runner,
+                                  matlab_cmd=self.matlab_cmd, python_runner=self.python_runner,
+                                  python=sys.executable, wait_time=self.wait_time,
+                                  timeouts=self.timeouts, limits=self.limits)
+
+    def cached(self, key, grade):
+        """
+        Return the cached grading result, or grade and cache the result
+
+        @param key: The cache key (None if the cache is disabled)
+        @param grade: The function grading the student
+        """
+        if key is None:
+            return grade()
+        if not self.force:
+            item = self.cache.get(key)
+            if item is not None:
+                return item
+        item = grade()
+        self.cache.put(key, item)
+        return item
 
     def grade_exception_file(self, hw_str, student_dir):
         """
         Handle the file name exceptions
 
+        @param hw_str: The homework string
+        @param student_dir: The student directory
+        """
+        key = self.cache_key(hw_str, student_dir, 'exception')
+        return self.cached(key, lambda: self.grade_unknown_file(hw_str, student_dir))
+
+    def grade_unknown_file(self, hw_str, student_dir):
+        """
+        Grade a submission without the standard file name
+
         @param hw_str: The homework string
         @param student_dir: The student directory
         """
@@ -136,54 +393,85 @@ class Grader():
         cnt_passes = 0
         msg = ""
         email = NULL_EMAIL
+        tests = []
         starting_time = time()
 
         if len(local_files) == 1: # only one file
             _file = local_files[0]
             if _file.endswith('.m') or _file.endswith('.asv'):
                 student_code = 'matlab'
-                shutil.copy(os.path.join(student_dir, _file), \
-                        os.path.join(student_dir, hw_str+'.m'))
-                cnt_passes, email, msg = self.matlab_grade(student_dir, hw_str)
+                link_or_copy(os.path.join(student_dir, _file),
+                             os.path.join(student_dir, hw_str+'.m'))
+                cnt_passes, email, msg, tests = self.matlab_grade(student_dir, hw_str)
 
             elif _file.endswith('.py'):
                 student_code = 'python'
-                shutil.copy(os.path.join(student_dir, _file), \
-                        os.path.join(student_dir, hw_str+'.py'))
-                cnt_passes, email, msg = self.python_grade(student_dir, hw_str)
+                link_or_copy(os.path.join(student_dir, _file),
+                             os.path.join(student_dir, hw_str+'.py'))
+                cnt_passes, email, msg, tests = self.python_grade(student_dir, hw_str)
 
             elif _file.endswith('.ipynb'):
                 student_code = 'jupyter'
-                try:
-                    shutil.copy(os.path.join(student_dir, _file), \
-                            os.path.join(student_dir, hw_str+'.ipynb'))
-                except shutil.SameFileError:
-                    pass
+                link_or_copy(os.path.join(student_dir, _file),
+                             os.path.join(student_dir, hw_str+'.ipynb'))
 
-                self.convert_to_python(student_dir, hw_str)
-                cnt_passes, email, msg = self.python_grade(student_dir, hw_str)
+                if self.convert_to_python(student_dir, hw_str):
+                    cnt_passes, email, msg, tests = self.python_grade(student_dir, hw_str)
+                else:
+                    msg = '  {{Invalid Notebook}}  '
 
             else:
-                # try to run with MATLAB or Python
-                shutil.copy(os.path.join(student_dir, _file), \
-                        os.path.join(student_dir, hw_str+'.m'))
-                cnt_passes, email, msg = self.matlab_grade(student_dir, hw_str)
-                running_time = time() - starting_time
-                if cnt_passes > 0:
-                    return cnt_passes, email, 'matlab', running_time, msg
-
-                shutil.copy(os.path.join(student_dir, _file), \
-                        os.path.join(student_dir, hw_str+'.py'))
-                cnt_passes, email, msg = self.python_grade(student_dir, hw_str)
-                running_time = time() - starting_time
-                if cnt_passes > 0:
-                    return cnt_passes, email, 'python', running_time, msg
+                student_code, (cnt_passes, email, msg, tests) = \
+                    self.grade_misnamed_file(hw_str, student_dir, _file)
 
             running_time = time() - starting_time
-            return cnt_passes, email, student_code, running_time, msg
+            return cnt_passes, email, student_code, running_time, msg, tests
 
         student_code = 'multi-f'
-        return 0, NULL_EMAIL, student_code, 0, msg
+        return 0, NULL_EMAIL, student_code, 0, msg, tests
+
+    def grade_misnamed_file(self, hw_str, student_dir, file_name):
+        """
+        Grade a file without a known extension in the language detected from its content
+        (see language.py). When the language is ambiguous, the file is graded with MATLAB
+        and Python concurrently, the first to pass a test wins and the other is cancelled.
+
+        @param hw_str: The homework string
+        @param student_dir: The student directory
+        @param file_name: The file name
+        @return: The language ('unknown' if neither passed a test) and the grade
+        """
+        with open(os.path.join(student_dir, file_name), 'r', encoding='utf-8',
+                  errors='ignore') as code_file:
+            language = detect_language(code_file.read())
+        runners = {student_code: grade for student_code, grade in
+                   (('matlab', self.matlab_grade), ('python', self.python_grade))
+                   if language in (None, student_code)}
+        for student_code in runners:
+            link_or_copy(os.path.join(student_dir, file_name),
+                         os.path.join(student_dir, hw_str + ('.m' if student_code == 'matlab'
+                                                             else '.py')))
+        if len(runners) == 1:
+            return language, runners[language](student_dir, hw_str)
+
+        cancel = threading.Event()
+        with ThreadPoolExecutor(max_workers=len(runners)) as executor:
+            futures = {executor.submit(grade, student_dir, hw_str, cancel): student_code
+                       for student_code, grade in runners.items()}
+            pending = set(futures)
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.result()[0] > 0:
+                            return futures[future], future.result()
+            finally:
+                # the other runner stops before the executor waits for it (also when a
+                # runner raised)
+                cancel.set()
+        # neither passed, the Python result is reported as before
+        return 'unknown', next(future.result() for future, student_code in futures.items()
+                               if student_code == 'python')
 
     def grade_standard_file(self, hw_str, student_dir):
         """
@@ -193,20 +481,19 @@ class Grader():
         @param student_dir: The student directory
         """
         data = []
-
-        if os.path.exists(os.path.join(student_dir, hw_str + '.m')):
-            student_code = 'matlab'
-            starting_time = time()
-            cnt_passes, email, msg = self.matlab_grade(student_dir, hw_str)
-            running_time = time() - starting_time
-            data.append( (cnt_passes, email, student_code, running_time, msg))
-
-        if os.path.exists(os.path.join(student_dir, hw_str + '.py')):
-            student_code = 'python'
-            starting_time = time()
-            cnt_passes, email, msg = self.python_grade(student_dir, hw_str)
-            running_time = time() - starting_time
-            data.append( (cnt_passes, email, student_code, running_time, msg))
+        runners = [(student_code, grade) for student_code, extension, grade in
+                   (('matlab', '.m', self.matlab_grade), ('python', '.py', self.python_grade))
+                   if os.path.exists(os.path.join(student_dir, hw_str + extension))]
+        # the keys are computed before any test runs in the student directory
+        keys = [self.cache_key(hw_str, student_dir, student_code) for student_code, _ in runners]
+
+        for (student_code, grade), key in zip(runners, keys):
+            def grade_file(student_code=student_code, grade=grade):
+                starting_time = time()
+                cnt_passes, email, msg, tests = grade(student_dir, hw_str)
+                running_time = time() - starting_time
+                return cnt_passes, email, student_code, running_time, msg, tests
+            data.append(self.cached(key, grade_file))
 
         return data
 
@@ -218,7 +505,7 @@ class Grader():
         @param student_info: The student information
         @param item: The student item
         """
-        cnt_passes, email, student_code, running_time, msg = item
+        cnt_passes, email, student_code, running_time, msg = item[:5]
         msg = msg.replace('PASS', 'P').replace('FAIL', 'F')
 
         if msg.find('@') != -1:
@@ -228,68 +515,186 @@ class Grader():
               f'scored: {cnt_passes:4d} | {student_info[0]:<20} | {student_info[1]} | '\
               f'{email: <25} | {student_code:<8} | {running_time: 6.2f} sec | {msg:<25}\n')
 
-    def output(self, grades_file, i, student_info, data):
+    def grade_student(self, hw_str, student_file, source=None):
         """
-        Output the grades to the file
+        Unzip and grade a single student
 
-        @param grades_file: The grades file
-        @param i: The student index
-        @param student_info: The student information
-        @param data: The student data
+        @param hw_str: The homework string
+        @param student_file: The student's zip file
+        @param source: The source of the student's zip file (see collect_dirs)
+        @return: The student information and the student data
         """
-        for _item in data:
-            cnt_passes, email, student_code, running_time, msg = _item
-            self.println(i, student_info, _item)
-            msg = msg.replace('PASS', 'P').replace('FAIL', 'F')
-            grades_file.write(f'{student_info[0]:<20}, {student_info[1]}, ' \
-                              f'{email:<25}, {student_code:<8}, {cnt_passes:4d}, ' \
-                              f'{running_time: 6.2f} sec, {msg:<25}\n')
+        if isinstance(source, Future):
+            with self.tracer.span('wait_download', student=Path(student_file).stem):
+                source.result()
+
+        student_dir = os.path.join(self.scratch_dir or self.submission_dir,
+                                   Path(student_file).stem)
+        try:
+            with self.tracer.span('extract', student=Path(student_file).stem):
+                # a fresh directory, so that nothing is left over from a previous run
+                shutil.rmtree(student_dir, ignore_errors=True)
+                if isinstance(source, str):
+                    self.archive.extract_student(source, student_dir)
+                else:
+                    with zipfile.ZipFile(student_file, 'r') as zip_ref:
+                        extract_relevant(zip_ref, student_dir, self.extensions,
+                                         self.max_file_size)
+                # a test submitted by the student would run instead of the instructor's
+                remove_test_copies(student_dir, self.matlab_test + self.python_test)
+
+            student_info = Path(student_file).stem.split('_')[:2]
 
-    def grade(self, hw_str='hw00', output_file='grades.csv'):
+            if student_info[-1] == 'LATE':
+                student_info = Path(student_file).stem.split('_')[0], \
+                    Path(student_file).stem.split('_')[2]
+
+            data = self.grade_standard_file(hw_str, student_dir)
+
+            if len(data) == 0:
+                data.append(self.grade_exception_file(hw_str, student_dir))
+
+            return student_info, data
+        finally:
+            if self.scratch_dir is not None:
+                shutil.rmtree(student_dir, ignore_errors=True)
+
+    def journal_student(self, journal, hw_str, student_file, source=None):
         """
-        Grade the students
+        Grade a single student and append the result to the journal
 
+        @param journal: The grading journal
         @param hw_str: The homework string
-        @param output_file: The output file
+        @param student_file: The student's zip file
+        @param source: The source of the student's zip file (see collect_dirs)
+        @return: The journal record
         """
-        # create a file to store the grades
-        with open(output_file, 'w', encoding='utf-8') as grades_file:
-            grades_file.write('Name,ID,Email,Language,Score,RunTime,Message\n')
-            # Unzip the submission file
-            if not os.path.exists(self.submission_dir):
-                print('Unzipping the submission file ...')
-                unzip(self.submission_file, self.submission_dir, skip_dir=False)
-
-            print(f'Submissions unzipped in {self.submission_dir}\n')
-
-            student_dirs = self.get_dirs()
+        try:
+            with self.tracer.span('student', student=Path(student_file).stem):
+                student_info, data = self.grade_student(hw_str, student_file, source)
+        except zipfile.BadZipFile:
+            return journal.append(Path(student_file).stem, [], [], status='bad-zip')
+        return journal.append(Path(student_file).stem, student_info, data)
+
+    def grade_students(self, journal, hw_str, student_dirs, jobs):
+        """
+        Grade the students concurrently, the results are reported in student order and
+        added to self.results. The students already in the journal are not graded again.
 
-            self.total_students = len(student_dirs)
+        @param journal: The grading journal
+        @param hw_str: The homework string
+        @param student_dirs: The students' zip files mapped to their sources
+        @param jobs: The number of students graded concurrently
+        """
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # the local zip files are graded first, while the link submissions download
+            futures = {}
+            for student_file in sorted(student_dirs,
+                                       key=lambda f: isinstance(student_dirs[f], Future)):
+                if journal.get(Path(student_file).stem) is None:
+                    futures[student_file] = executor.submit(
+                        self.journal_student, journal, hw_str, student_file,
+                        student_dirs[student_file])
+            try:
+                for i, student_file in enumerate(sorted(student_dirs)):
+                    future = futures.get(student_file)
+                    try:
+                        record = journal.get(Path(student_file).stem) if future is None \
+                            else future.result()
+                    except Exception as err: # pylint: disable=broad-exception-caught
+                        print(f'Grading failed: {student_file} ({err!r})')
+                        continue
+
+                    if record['status'] == 'bad-zip':
+                        print(f'Bad zip file: {student_file}')
+                        continue
+                    for _item in record['data']:
+                        self.println(i, record['info'], _item)
+                    self.results.add(record['info'], record['data'])
+            except BaseException:
+                # do not start the remaining students (e.g. after Ctrl-C)
+                for future in futures.values():
+                    future.cancel()
+                raise
+
+    def write_grades(self, output_file, formats=()):
+        """
+        Write the grades of the students (the best record of every ID) to the output file
 
-            for i, student_file in enumerate(student_dirs):
-                student_dir = os.path.join(self.submission_dir, Path(student_file).stem)
-                try:
-                    unzip(student_file, student_dir)
-                except zipfile.BadZipFile:
-                    print(f'Bad zip file: {student_file}')
-                    continue
+        @param output_file: The output CSV file
+        @param formats: The other output formats, written next to it ('jsonl', 'parquet')
+        """
+        for path in self.results.write(output_file, formats):
+            print(f'Grades saved in {path}')
 
-                student_info = Path(student_file).stem.split('_')[:2]
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def grade(self, hw_str='hw00', output_file='grades.csv', jobs=None, resume=False,
+              journal_file=None, formats=(), trace_file=None):
+        """
+        Grade the students
 
-                if student_info[-1] == 'LATE':
-                    student_info = Path(student_file).stem.split('_')[0], \
-                        Path(student_file).stem.split('_')[2]
+        @param hw_str: The homework string
+        @param output_file: The output file
+        @param jobs: The number of students graded concurrently (defaults to self.jobs)
+        @param resume: Skip the students already graded in the journal of a previous run
+        @param journal_file: The journal file (defaults to output_file + '.journal')
+        @param formats: The other output formats of the grades, 'jsonl' and/or 'parquet'
+            (one row per test, needs pyarrow or fastparquet)
+        @param trace_file: Trace the grading phases of every student and test to this file
+            (Chrome trace events, see tracing.py), and print the phases taking the most time
+        """
+        jobs = self.jobs if jobs is None else max(1, jobs)
+        journal_file = output_file + '.journal' if journal_file is None else journal_file
+        self.tracer = Tracer(enabled=trace_file is not None)
+
+        # Read the student zip files in place from the submission file
+        self.archive = None
+        if os.path.exists(self.submission_file):
+            self.archive = SubmissionArchive(self.submission_file, self.extensions,
+                                             self.max_file_size)
+            self.archive.extract_links(self.submission_dir)
+            print(f'Submissions read from {self.submission_file}\n')
+        else:
+            print(f'Submissions found in {self.submission_dir}\n')
+
+        # every graded student is recorded in the journal, and kept in self.results
+        self.results = ResultTable()
+        with Downloader(self.download_workers, tracer=self.tracer) as downloader, \
+                GradingJournal(journal_file, resume=resume) as journal:
+            with self.tracer.span('collect_dirs'):
+                student_dirs = self.collect_dirs(downloader, self.archive)
 
-                data = self.grade_standard_file(hw_str, student_dir)
+            self.total_students = len(student_dirs)
 
-                if len(data) > 0:
-                    self.output(grades_file, i, student_info, data)
-                else:
-                    data.append(self.grade_exception_file(hw_str, student_dir))
-                    self.output(grades_file, i, student_info, data)
-
-        grades_file.close()
-        print(f'\nGrades saved in {output_file}\n')
-        print('Cleaning up ...')
-        remove_duplicates(output_file)
-        print('==============  Grading completed! =============\n\n')
+            if resume:
+                print(f'Resuming from {journal_file}: {len(journal.records)} students '
+                      'already graded\n')
+
+            with self.tracer.span('start_runners'):
+                if self.matlab_workers > 0 and self.matlab_test:
+                    self.matlab_pool = MatlabPool(self.matlab_workers, self.matlab_cmd,
+                                                  limits=self.limits)
+                if self.python_runner == 'forkserver' and self.python_test:
+                    self.fork_server = ForkServer(limits=self.limits)
+
+            try:
+                # the tests run in place, they are read-only while the students are graded
+                with read_only([os.path.join(self.test_dir, _test)
+                                for _test in self.matlab_test + self.python_test]):
+                    self.grade_students(journal, hw_str, student_dirs, jobs)
+            finally:
+                if self.matlab_pool is not None:
+                    self.matlab_pool.close()
+                    self.matlab_pool = None
+                if self.fork_server is not None:
+                    self.fork_server.close()
+                    self.fork_server = None
+
+        print()
+        with self.tracer.span('write_grades'):
+            self.write_grades(output_file, formats)
+        if trace_file is not None:
+            self.tracer.write(trace_file)
+            print(f'\nTrace saved in {trace_file}\n')
+            self.tracer.print_summary()
+        print('\n==============  Grading completed! =============\n\n')
@@ -0,0 +1,80 @@
+"""
+Crash-safe journal of the graded students.
+"""
+
+import json
+import os
+import threading
+
+class GradingJournal():
+    """
+    Append-only JSON lines journal, one record per graded student. Every record is
+    flushed and fsync'd as soon as the student is graded, so a killed run can resume.
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = self.load() if resume else {}
+        # pylint: disable-next=consider-using-with
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def load(self):
+        """
+        Load the records of the journal, a torn last line (from a crash) is dropped
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+
+        valid_size = 0
+        with open(self.path, 'rb') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                records[record['student']] = record
+                valid_size += len(line)
+
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.truncate(valid_size)
+        return records
+
+    def get(self, student):
+        """
+        Get the record of a student, None if the student is not in the journal
+        """
+        return self.records.get(student)
+
+    def append(self, student, student_info, data, status='ok'):
+        """
+        Append the record of a graded student
+
+        @param student: The student's key (the submission file name)
+        @param student_info: The student information
+        @param data: The student data
+        @param status: 'ok' or 'bad-zip'
+        """
+        record = {'student': student, 'info': list(student_info),
+                  'data': [list(_item) for _item in data], 'status': status}
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.records[student] = record
+        return record
+
+    def close(self):
+        """
+        Close the journal
+        """
+        self.file.close()
@@ -0,0 +1,56 @@
+"""
+Content-based detection of the language (MATLAB or Python) of a misnamed submission.
+"""
+
+import ast
+import re
+
+# the syntax of each language, with its weight, counted per line
+MATLAB_SYNTAX = [(re.compile(pattern, re.MULTILINE), weight) for pattern, weight in (
+    (r'^\s*(?:function|classdef)\b', 3),
+    (r'^\s*end\s*;?\s*$', 2),
+    (r'^\s*%', 1),
+    (r'~=', 2),
+    (r'\belseif\b', 2),
+    (r'^\s*for\s+\w+\s*=', 2),
+    (r'\b(?:fprintf|disp|numel|zeros|ones)\s*\(', 1),
+    (r'\.[*/^]', 1),
+    (r';\s*$', 1),
+)]
+PYTHON_SYNTAX = [(re.compile(pattern, re.MULTILINE), weight) for pattern, weight in (
+    (r'^\s*def\s+\w+\s*\(.*\)\s*(?:->.*)?:\s*$', 3),
+    (r'^\s*(?:import|from)\s+\w+', 3),
+    (r'^\s*(?:if|for|while|with|try|except|else|class)\b.*:\s*$', 1),
+    (r'^\s*#', 1),
+    (r'\belif\b', 2),
+    (r'\b(?:None|True|False|self)\b', 1),
+    (r'\bprint\s*\(', 1),
+)]
+
+def syntax_score(text, syntax):
+    """
+    The weighted number of lines using the syntax of a language
+    """
+    return sum(weight * len(pattern.findall(text)) for pattern, weight in syntax)
+
+
+def detect_language(text):
+    """
+    Detect the language of the code: parse it as Python, and count the lines using the
+    syntax of each language
+
+    @param text: The code
+    @return: 'matlab', 'python' or None when it is ambiguous (e.g. 'x = 1;' is valid in both)
+    """
+    matlab = syntax_score(text, MATLAB_SYNTAX)
+    python = syntax_score(text, PYTHON_SYNTAX)
+    try:
+        ast.parse(text)
+    except (SyntaxError, ValueError):
+        # code with a syntax error is still recognized when most of its syntax is Python
+        if matlab > 0 and matlab >= 2 * python:
+            return 'matlab'
+        if python > 0 and python >= 2 * matlab:
+            return 'python'
+        return None
+    return 'python' if python > 0 and python >= matlab else None
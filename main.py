@@ -1,17 +1,42 @@
 """
 Test script for grading homework.
 """
+import argparse
+
 from grader import Grader
 
+parser = argparse.ArgumentParser(description='Grade the homework submissions.')
+parser.add_argument('--force', action='store_true',
+                    help='regrade every student, ignoring the cached results')
+parser.add_argument('--resume', action='store_true',
+                    help='resume an interrupted run from its journal (grades.csv.journal)')
+parser.add_argument('--calibrate', metavar='DIR',
+                    help='calibrate the timeouts of the tests with the reference solution in DIR '
+                         '(hw00.py, hw00.m), stored in tests/timeouts.json, then exit')
+parser.add_argument('--trace', metavar='FILE',
+                    help='trace the grading phases to FILE (open it in https://ui.perfetto.dev)')
+args = parser.parse_args()
+
 # Initialize the grader
 # The first argument is the submission file (downloaded from Canvas)
 # The second argument is the submission directory (where the files will be extracted)
 # The third argument is the test directory (where the test files are located)
 # The fourth argument is the wait time for each test (in seconds)
+# The fifth argument is the number of students graded in parallel
+# The results of unchanged submissions are cached in cache_dir (--force regrades them)
 # You may not need to change these arguments
-g = Grader('submissions.zip', 'submissions', 'tests', wait_time=60)
+g = Grader('submissions.zip', 'submissions', 'tests', wait_time=60, jobs=4,
+           cache_dir='.grade_cache', force=args.force)
+
+# The timeout of every test is derived from the runtime of the reference solution
+# (5 times longer, at least 5 seconds, at most wait_time), once the tests are calibrated
+if args.calibrate:
+    g.calibrate(args.calibrate, hw_str='hw00', multiplier=5.0, floor=5.0)
+    raise SystemExit
 
 # Grade the students
 # The argument is the homework string (hw00, hw01, etc.)
 # The output file is the CSV file where the grades will be saved
-g.grade(hw_str='hw00', output_file='grades.csv')
+# Every graded student is recorded in the journal, --resume skips them after a crash
+# --trace records the time of every phase, student and test
+g.grade(hw_str='hw00', output_file='grades.csv', resume=args.resume, trace_file=args.trace)
@@ -0,0 +1,258 @@
+"""
+Pool of long-lived MATLAB workers that run the tests without a new MATLAB launch per test.
+"""
+
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import uuid
+from time import time
+
+import psutil
+
+from utility import kill, apply_limits, format_output, TIMEOUT_ERROR, RUNTIME_ERROR, \
+    OUTPUT_LIMIT_ERROR, CANCEL_POLL, MAX_OUTPUT, GRACE_TIME, LINE_SIZE, MARKER
+
+STARTUP_WAIT = 300
+
+def matlab_quote(text):
+    """
+    Quote a string as a MATLAB character vector
+    """
+    return "'" + str(text).replace("'", "''") + "'"
+
+def matlab_run(test_path):
+    """
+    The MATLAB command running a test script in place, in the current folder (the student's
+    folder): the test folder is added to the path and the script is called by its name,
+    run() would change the current folder to the test folder
+    """
+    folder, name = os.path.split(os.path.abspath(test_path))
+    name = os.path.splitext(name)[0]
+    if not (name.isidentifier() and name.isascii()):
+        return f'run({matlab_quote(test_path)})'
+    return f'addpath({matlab_quote(folder)}); {name}'
+
+class MatlabWorker():
+    """
+    A MATLAB (or Octave) process reading commands from its standard input.
+    """
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, # pylint: disable=consider-using-with
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        text=True,
+                                        errors='replace',
+                                        bufsize=1,
+                                        start_new_session=True)
+        self.lines = queue.Queue()
+        self.runs = 0
+        for name, stream in (('out', self.process.stdout), ('err', self.process.stderr)):
+            threading.Thread(target=self._read, args=(name, stream), daemon=True).start()
+
+    def _read(self, name, stream):
+        """
+        Forward the lines of a stream to the line queue, None marks the end of the stream
+        """
+        for line in iter(lambda: stream.readline(LINE_SIZE), ''):
+            self.lines.put((name, line))
+        self.lines.put((name, None))
+
+    def request(self, command, max_wait, expected=None, cancel=None):
+        """
+        Send a command to the worker and collect its output, only the PASS/FAIL markers of
+        the standard output and the first MAX_OUTPUT bytes of the standard error are kept
+
+        @param command: The MATLAB command (a single line)
+        @param max_wait: The maximum wait time (in seconds)
+        @param expected: The number of PASS/FAIL markers of the command, it is stopped
+            GRACE_TIME seconds after printing them
+        @param cancel: A threading.Event, set to stop waiting (checked every CANCEL_POLL
+            seconds)
+        @return: The PASS/FAIL markers, the standard error and the status ('ok', 'timeout',
+            'crash', 'overflow', 'complete' or 'cancelled', see OutputCapture.wait)
+        """
+        token = f'__grader_{uuid.uuid4().hex}__'
+        done = {'out': False, 'err': False}
+        std_out, std_err = [], []
+        sizes = {'out': 0, 'err': 0}
+        try:
+            self.process.stdin.write(f'{command}\n'
+                                     f'fprintf(1, \'\\n{token}\\n\'); '
+                                     f'fprintf(2, \'\\n{token}\\n\');\n')
+            self.process.stdin.flush()
+        except OSError:
+            return '', '', 'crash'
+
+        deadline, status = time() + max_wait, 'timeout'
+        while not all(done.values()):
+            if cancel is not None and cancel.is_set():
+                return ''.join(std_out), ''.join(std_err), 'cancelled'
+            wait = max(0, deadline - time())
+            try:
+                name, line = self.lines.get(
+                    timeout=wait if cancel is None else min(wait, CANCEL_POLL))
+            except queue.Empty:
+                if time() < deadline:
+                    continue
+                return ''.join(std_out), ''.join(std_err), status
+            if line is None:
+                return ''.join(std_out), ''.join(std_err), 'crash'
+            sizes[name] += len(line)
+            if line.strip() == token:
+                done[name] = True
+            elif sizes[name] > MAX_OUTPUT:
+                return ''.join(std_out), ''.join(std_err), 'overflow'
+            elif name == 'out':
+                std_out += MARKER.findall(line)
+                if expected is not None and status == 'timeout' and len(std_out) >= expected:
+                    deadline, status = min(deadline, time() + GRACE_TIME), 'complete'
+            else:
+                std_err.append(line)
+        return ''.join(std_out), ''.join(std_err), 'ok'
+
+    def close(self):
+        """
+        Stop the worker
+        """
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write('exit\n')
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                kill(self.process.pid)
+        self.process.wait()
+
+
+def worker_cpu_time(worker):
+    """
+    The CPU time used by a worker (and its children) so far, None if it exited
+    """
+    try:
+        times = psutil.Process(worker.process.pid).cpu_times()
+        return times.user + times.system + times.children_user + times.children_system
+    except psutil.NoSuchProcess:
+        return None
+
+
+def worker_usage(worker, cpu_time, status):
+    """
+    The (CPU time, RSS, exit status) of a test run by a worker
+    """
+    exit_status = 0 if status == 'ok' else worker.process.poll()
+    try:
+        rss = psutil.Process(worker.process.pid).memory_info().rss
+    except psutil.NoSuchProcess:
+        return None, None, exit_status
+    end_time = worker_cpu_time(worker)
+    if cpu_time is None or end_time is None:
+        return None, rss, exit_status
+    return end_time - cpu_time, rss, exit_status
+
+
+class MatlabPool(): # pylint: disable=too-many-instance-attributes
+    """
+    Pool of MATLAB workers. A worker resets its path and workspace before each test,
+    and it is replaced after a crash, a timeout or max_runs tests.
+    """
+    def __init__(self, size, matlab_cmd='matlab', max_runs=200, limits=None):
+        self.size = max(1, size)
+        self.command = shlex.split(matlab_cmd) + ['-nojvm', '-nosplash', '-nodesktop']
+        self.max_runs = max_runs
+        # the CPU time limit would count the whole life of a worker, the timeout applies
+        self.limits = {name: value for name, value in (limits or {}).items() if name != 'cpu'}
+        self.idle = queue.LifoQueue()
+        self.slots = threading.Semaphore(self.size)
+        self.lock = threading.Lock()
+        self.workers = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _start_worker(self):
+        """
+        Start a worker and wait until MATLAB is ready
+        """
+        worker = MatlabWorker(self.command)
+        apply_limits(worker.process.pid, self.limits)
+        with self.lock:
+            self.workers.add(worker)
+        _, _, status = worker.request('', STARTUP_WAIT)
+        if status != 'ok':
+            self._discard(worker)
+            raise RuntimeError(f'MATLAB worker failed to start: {" ".join(self.command)}')
+        return worker
+
+    def _discard(self, worker):
+        """
+        Stop a worker and remove it from the pool
+        """
+        with self.lock:
+            self.workers.discard(worker)
+        if worker.process.poll() is None:
+            kill(worker.process.pid)
+        worker.process.wait()
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def run(self, student_path, test_path, max_wait=30, expected=None, usage=None,
+            cancel=None):
+        """
+        Run a test file in the student's directory
+
+        @param student_path: The student's directory
+        @param test_path: The test file
+        @param max_wait: The maximum wait time (in seconds)
+        @param expected: The number of PASS/FAIL markers of the test (see execute_system_call)
+        @param usage: A list, the (CPU time, RSS, exit status) of the test is appended, the
+            CPU time used by the worker during the test and its RSS after the test
+        @param cancel: A threading.Event, the test is stopped (and its worker discarded)
+            when it is set
+        @return: The test output in the execute_system_call format
+        """
+        with self.slots:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                worker = self._start_worker()
+
+            student_path = matlab_quote(student_path)
+            command = (f'restoredefaultpath; clear all; clear classes; cd({student_path}); '
+                       f'try, {matlab_run(test_path)}; '
+                       'catch grader_err, fprintf(2, \'%s\\n\', grader_err.message); end; '
+                       'clear all;')
+            cpu_time = worker_cpu_time(worker)
+            std_out, std_err, status = worker.request(command, max_wait, expected, cancel)
+            std_err = std_err if std_err.strip() else ''
+            worker.runs += 1
+            if usage is not None:
+                usage.append(worker_usage(worker, cpu_time, status))
+
+            if status == 'ok' and worker.runs < self.max_runs:
+                self.idle.put(worker)
+            else:
+                self._discard(worker)
+
+            if status == 'timeout':
+                return TIMEOUT_ERROR
+            if status == 'crash':
+                return format_output(std_out, std_err) + RUNTIME_ERROR
+            if status == 'overflow':
+                return format_output(std_out, std_err) + OUTPUT_LIMIT_ERROR
+            return format_output(std_out, std_err)
+
+    def close(self):
+        """
+        Stop all workers
+        """
+        with self.lock:
+            workers = list(self.workers)
+            self.workers.clear()
+        for worker in workers:
+            worker.close()
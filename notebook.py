@@ -0,0 +1,144 @@
+"""
+In-process conversion of the Jupyter notebooks to Python scripts, instead of starting
+``jupyter nbconvert`` for every notebook.
+"""
+
+import hashlib
+import json
+import re
+
+NOTEBOOK_VERSION = 2
+
+# the cell magics whose body is Python code, the body of the others (%%bash, %%html,
+# %%writefile, ...) is not
+PYTHON_CELL_MAGICS = {'time', 'timeit', 'capture', 'prun', 'debug'}
+# a shell escape (!ls), a magic (%matplotlib inline), their assigned forms (files = !ls),
+# a help request (np.sum?, ?np.sum)
+IPYTHON_LINE = re.compile(r'''
+    (?P<indent>\s*)
+    (?:[\w.,\s]+=\s*)?[!%]
+  | (?P<help_indent>\s*)(?:\?+[\w.]+|[\w.]+\?+)\s*$
+''', re.VERBOSE)
+# the triple quotes, and the strings and comments which may contain them
+STRING_TOKEN = re.compile(r'''"""|\'\'\'|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|\#.*''')
+
+def cell_source(cell):
+    """
+    The source of a cell, as a string
+    """
+    source = cell.get('source', cell.get('input', ''))
+    return ''.join(source) if isinstance(source, list) else source
+
+
+def triple_quote(line, quote=None):
+    """
+    The triple quote still open at the end of a line of Python code
+
+    @param line: The line
+    @param quote: The triple quote open at the start of the line (None outside a string)
+    @return: The open triple quote, None if the line ends outside a triple-quoted string
+    """
+    position = 0
+    while True:
+        if quote is not None:
+            end = line.find(quote, position)
+            if end < 0:
+                return quote
+            position, quote = end + 3, None
+        match = STRING_TOKEN.search(line, position)
+        if match is None:
+            return None
+        if match.group() in ('"""', "'''"):
+            quote = match.group()
+        position = match.end()
+
+
+def strip_magics(source):
+    """
+    Comment out the IPython syntax of a code cell (magics, shell escapes, help requests) with
+    its continuation lines, a line in an indented block is replaced by pass to keep the block
+    valid. The lines continuing a line of code or inside a triple-quoted string are kept.
+
+    @param source: The source of the code cell
+    @return: The Python code
+    """
+    lines = source.splitlines()
+    if lines and lines[0].startswith('%%'):
+        if lines[0][2:].split(' ', 1)[0] not in PYTHON_CELL_MAGICS:
+            return '\n'.join('# ' + line for line in lines)
+        lines[0] = '# ' + lines[0]
+
+    code = []
+    # the line continues a magic, the line continues a line of code, the open triple quote
+    magic, continued, quote = False, False, None
+    indent = ''
+    for line in lines:
+        if magic:
+            code.append(f'{indent}# {line.strip()}')
+            magic = line.endswith('\\')
+            continue
+        match = None if continued or quote else IPYTHON_LINE.match(line)
+        if match:
+            indent = match.group('indent') or match.group('help_indent') or ''
+            code.append(f'{indent}pass  # {line.strip()}' if indent else f'# {line}')
+            magic = line.endswith('\\')
+        else:
+            code.append(line)
+            quote = triple_quote(line, quote)
+            continued = quote is None and line.endswith('\\')
+    return '\n'.join(code)
+
+
+def notebook_to_script(text):
+    """
+    Convert a notebook to a Python script: the code cells without their IPython syntax, and
+    the markdown cells as comments
+
+    @param text: The JSON of the notebook
+    @return: The Python script
+    """
+    notebook = json.loads(text)
+    # nbformat 4 lists the cells, nbformat 3 lists them in worksheets
+    cells = notebook.get('cells') or [cell for worksheet in notebook.get('worksheets', [])
+                                      for cell in worksheet.get('cells', [])]
+    blocks = []
+    for cell in cells:
+        source = cell_source(cell)
+        if not source.strip():
+            continue
+        if cell.get('cell_type') == 'code':
+            blocks.append(strip_magics(source))
+        elif cell.get('cell_type') in ('markdown', 'raw', 'heading'):
+            blocks.append('\n'.join('# ' + line for line in source.splitlines()))
+    return '\n\n'.join(blocks) + '\n'
+
+
+def convert_notebook(notebook_path, script_path, cache=None):
+    """
+    Convert a notebook file to a Python script file, the scripts are cached by the content
+    of the notebooks
+
+    @param notebook_path: The notebook
+    @param script_path: The Python script written
+    @param cache: The result cache (see result_cache.py), None to disable the cache
+    @return: False if the notebook is not valid JSON (no script is written)
+    """
+    with open(notebook_path, 'rb') as notebook_file:
+        content = notebook_file.read()
+    key = hashlib.sha256(f'notebook {NOTEBOOK_VERSION}'.encode('utf-8') + b'\0' +
+                         content).hexdigest()
+
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        script = cached[0]
+    else:
+        try:
+            script = notebook_to_script(content.decode('utf-8', errors='ignore'))
+        except (ValueError, AttributeError, TypeError):
+            return False
+        if cache is not None:
+            cache.put(key, [script])
+
+    with open(script_path, 'w', encoding='utf-8') as script_file:
+        script_file.write(script)
+    return True
@@ -0,0 +1,224 @@
+"""
+Persistent MinHash/LSH index of the submissions, to check a cohort against the archive of
+previous homeworks and semesters without comparing all the pairs.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+TOKEN = re.compile(r'\w+|[^\w\s]')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    course TEXT, term TEXT, hw TEXT, student TEXT, language TEXT,
+    signature BLOB,
+    UNIQUE (course, term, hw, student, language));
+CREATE TABLE IF NOT EXISTS buckets (band INTEGER, hash INTEGER, doc INTEGER);
+CREATE INDEX IF NOT EXISTS buckets_band_hash ON buckets (band, hash);
+CREATE INDEX IF NOT EXISTS buckets_doc ON buckets (doc);
+"""
+
+def shingles(text, k=5):
+    """
+    Hash the k-token shingles of a text to 32-bit integers
+    """
+    tokens = TOKEN.findall(text.lower())
+    if len(tokens) < k:
+        tokens = tokens + [''] * (k - len(tokens))
+    return np.array(sorted({zlib.crc32(' '.join(tokens[i:i + k]).encode('utf-8'))
+                            for i in range(len(tokens) - k + 1)}), dtype=np.uint64)
+
+
+class PlagiarismIndex():
+    """
+    MinHash signatures of the submissions in an SQLite file, with an LSH table of
+    bands x rows buckets. Similar submissions (estimated Jaccard similarity of their
+    shingles) are found by looking up the buckets of a signature, in sub-linear time.
+    """
+    def __init__(self, path, num_perm=128, bands=32, seed=1):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+        # the parameters of an existing index win, so that the signatures stay comparable
+        meta = dict(self.connection.execute('SELECT key, value FROM meta'))
+        num_perm = int(meta.get('num_perm', num_perm))
+        self.bands = int(meta.get('bands', bands))
+        seed = int(meta.get('seed', seed))
+        if num_perm % self.bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.rows = num_perm // self.bands
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                        [('num_perm', str(num_perm)),
+                                         ('bands', str(self.bands)),
+                                         ('seed', str(seed))])
+
+        rng = np.random.default_rng(seed)
+        self.perm_a = rng.integers(1, int(MERSENNE_PRIME), num_perm, dtype=np.uint64)
+        self.perm_b = rng.integers(0, int(MERSENNE_PRIME), num_perm, dtype=np.uint64)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def signature(self, text):
+        """
+        Compute the MinHash signature of a text
+        """
+        hashes = shingles(text)
+        with np.errstate(over='ignore'):
+            permuted = (np.outer(self.perm_a, hashes) + self.perm_b[:, None]) \
+                % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def band_hashes(self, signature):
+        """
+        Hash the bands of a signature to signed 64-bit integers (SQLite integers)
+        """
+        return [int.from_bytes(hashlib.blake2b(signature[band * self.rows:
+                                                         (band + 1) * self.rows].tobytes(),
+                                               digest_size=8).digest(), 'little', signed=True)
+                for band in range(self.bands)]
+
+    def insert(self, key, text):
+        """
+        Insert (or replace) a submission in the index
+
+        @param key: The (course, term, hw, student, language) of the submission
+        @param text: The code of the submission
+        @return: The signature of the submission
+        """
+        return self.insert_many([(key, text)])[0]
+
+    def insert_many(self, submissions):
+        """
+        Insert (or replace) submissions in the index, in a single transaction
+
+        @param submissions: The (key, text) of the submissions, see insert
+        @return: The signatures of the submissions
+        """
+        signatures = [self.signature(text) for _, text in submissions]
+        with self.lock, self.connection:
+            for (key, _), signature in zip(submissions, signatures):
+                old = self.connection.execute(
+                    'SELECT id FROM docs WHERE course=? AND term=? AND hw=? AND student=? '
+                    'AND language=?', key).fetchone()
+                if old is not None:
+                    self.connection.execute('DELETE FROM buckets WHERE doc=?', old)
+                    self.connection.execute('DELETE FROM docs WHERE id=?', old)
+                doc = self.connection.execute(
+                    'INSERT INTO docs (course, term, hw, student, language, signature) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', (*key, signature.tobytes())).lastrowid
+                self.connection.executemany(
+                    'INSERT INTO buckets VALUES (?, ?, ?)',
+                    [(band, value, doc)
+                     for band, value in enumerate(self.band_hashes(signature))])
+        return signatures
+
+    def query(self, signature, threshold=0.5, language=None):
+        """
+        Find the indexed submissions similar to a signature
+
+        @param signature: The MinHash signature (see signature)
+        @param threshold: The minimum estimated Jaccard similarity
+        @param language: Only return the submissions in this language
+        @return: The (similarity, course, term, hw, student, language) of the matches,
+            the most similar first
+        """
+        with self.lock:
+            candidates = set()
+            for band, value in enumerate(self.band_hashes(signature)):
+                candidates.update(doc for (doc,) in self.connection.execute(
+                    'SELECT doc FROM buckets WHERE band=? AND hash=?', (band, value)))
+
+            matches = []
+            for doc in candidates:
+                row = self.connection.execute(
+                    'SELECT course, term, hw, student, language, signature FROM docs '
+                    'WHERE id=?', (doc,)).fetchone()
+                if row is None or (language is not None and row[4] != language):
+                    continue
+                other = np.frombuffer(row[5], dtype=np.uint32)
+                similarity = float(np.mean(other == signature))
+                if similarity >= threshold:
+                    matches.append((similarity, *row[:5]))
+        return sorted(matches, reverse=True)
+
+    def close(self):
+        """
+        Close the index
+        """
+        self.connection.close()
+
+
+def student_key(student_dir):
+    """
+    The student of a submission directory (name_ID_..., name_LATE_ID_...), by name and ID so
+    that two students with the same name stay apart
+    """
+    parts = student_dir.split('_')
+    if len(parts) > 2 and parts[1] == 'LATE':
+        parts = parts[:1] + parts[2:]
+    return '_'.join(parts[:2])
+
+
+def read_submissions(submission_dir, hw_str):
+    """
+    Read the MATLAB and Python submissions of a homework
+
+    @return: The (student, language, code) of the submissions, the students by name and ID
+        (see student_key)
+    """
+    for student_dir in sorted(os.listdir(submission_dir)):
+        for language, extension in (('matlab', '.m'), ('python', '.py')):
+            path = os.path.join(submission_dir, student_dir, hw_str + extension)
+            if os.path.isfile(path):
+                with open(path, 'r', encoding='utf-8', errors='ignore') as code_file:
+                    yield student_key(student_dir), language, code_file.read()
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def check_archive(submission_dir, hw_str, index_file, course, term, threshold=0.8):
+    """
+    Check the submissions against the archive of all the indexed submissions (previous
+    homeworks and semesters, and the other students of the cohort), after adding them to
+    the archive
+
+    @param submission_dir: The submission directory
+    @param hw_str: The homework string
+    @param index_file: The index file (created if it does not exist)
+    @param course: The course
+    @param term: The term (semester)
+    @param threshold: The minimum estimated Jaccard similarity
+    @return: The matches, (student, language, similarity, course, term, hw, other student),
+        the students by name and ID (see student_key)
+    """
+    matches = []
+    with PlagiarismIndex(index_file) as index:
+        submissions = [((course, term, hw_str, student, language), code)
+                       for student, language, code in read_submissions(submission_dir, hw_str)]
+        for (key, _), signature in zip(submissions, index.insert_many(submissions)):
+            for similarity, *other in index.query(signature, threshold, key[4]):
+                # a student resubmitting their own work (e.g. retaking the course) is fine
+                if other[3] != key[3]:
+                    matches.append((key[3], key[4], similarity, *other[:4]))
+
+    # the names are printed, without the IDs
+    for student, language, similarity, *other in matches:
+        other[3] = other[3].split('_')[0]
+        print(f'{student.split("_")[0]:<20} | {language:<8} | {similarity:5.2f} | '
+              f'{" | ".join(other)}')
+    return matches
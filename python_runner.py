@@ -0,0 +1,488 @@
+"""
+Fork-server that runs the Python tests without starting a new interpreter per test.
+
+The server imports the heavy modules (numpy, ...) once and forks a child for each
+(student, test). The child changes to the student's directory, writes to the pipes
+sent by the grader and runs the test file as __main__.
+
+The batch runner (run_batch) is one process per student instead: it imports the heavy
+modules and the student's module once, and forks a child for each test of the student.
+"""
+
+import array
+import json
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import traceback
+from time import time
+
+from utility import kill, kill_group, apply_limits, exit_code, peak_rss, resource_limits, \
+    wait_pid, OutputCapture, CANCEL_POLL, GRACE_TIME, RUNTIME_ERROR, TIMEOUT_ERROR
+
+PRELOAD = ('numpy',)
+SERVER_WAIT = 60
+# run a test file in place in a new interpreter (python -c RUN_TEST test_path), with the
+# student's directory (the working directory) first on sys.path and then the test directory,
+# python test_path would put the test directory first; the traceback of an error starts in
+# the test file, like the interpreter's
+RUN_TEST = '''import os, sys
+test_path = sys.argv[1]
+sys.argv = sys.argv[1:]
+sys.path[0:1] = [os.getcwd(), os.path.dirname(test_path)]
+sys.excepthook = lambda kind, error, trace: sys.__excepthook__(
+    kind, error.with_traceback(trace.tb_next), trace.tb_next)
+with open(test_path, 'rb') as test_file:
+    code = compile(test_file.read(), test_path, 'exec')
+exec(code, {'__name__': '__main__', '__file__': test_path})
+'''
+
+def _run_child(request, out_fd, err_fd):
+    """
+    Run a test file in the forked child, never returns
+    """
+    code = 1
+    try:
+        # the processes left by the test are killed with its process group (see kill)
+        os.setsid()
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(out_fd, 1)
+        os.dup2(err_fd, 2)
+        for _fd in (null_fd, out_fd, err_fd):
+            os.close(_fd)
+        sys.stdout = os.fdopen(1, 'w', closefd=False)
+        sys.stderr = os.fdopen(2, 'w', buffering=1, closefd=False)
+
+        _set_limits(request.get('limits'))
+
+        student_path, test_path = request['student_path'], request['test_path']
+        os.chdir(student_path)
+        sys.argv = [test_path]
+        # the test runs in place from the test directory, it imports the student's modules
+        # first (a module of the test directory does not shadow them)
+        sys.path[0:1] = [student_path, os.path.dirname(os.path.abspath(test_path))]
+        # the student's modules must not survive from the server (or another student),
+        # the batch runner imported the module of this student on purpose
+        if not request.get('keep_modules'):
+            _purge_modules(student_path)
+
+        import runpy # pylint: disable=import-outside-toplevel
+        runpy.run_path(test_path, run_name='__main__')
+        code = 0
+    except SystemExit as err:
+        if err.code is None or isinstance(err.code, int):
+            code = err.code or 0
+        else:
+            print(err.code, file=sys.stderr)
+    except BaseException as err: # pylint: disable=broad-exception-caught
+        # report the traceback from the test file, like the interpreter does
+        trace = err.__traceback__
+        while trace is not None and trace.tb_frame.f_code.co_filename != request['test_path']:
+            trace = trace.tb_next
+        traceback.print_exception(type(err), err, trace or err.__traceback__)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _set_limits(limits):
+    """
+    Apply the resource limits to the forked child
+    """
+    import resource # pylint: disable=import-outside-toplevel
+    for limit, values in resource_limits(limits):
+        try:
+            resource.setrlimit(limit, values)
+        except (ValueError, OSError):
+            pass # above the hard limit of the server
+
+
+def _purge_modules(student_path):
+    """
+    Remove the modules imported from the student's directory
+    """
+    for name, module in list(sys.modules.items()):
+        if os.path.abspath(getattr(module, '__file__', None) or '/')\
+                .startswith(os.path.abspath(student_path) + os.sep):
+            del sys.modules[name]
+
+
+def serve(socket_path, preload=PRELOAD):
+    """
+    Run the fork-server on a Unix socket until the standard input is closed
+
+    @param socket_path: The path of the Unix socket
+    @param preload: The modules imported once by the server
+    """
+    for module in preload:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(64)
+
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda *args: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ, 'accept')
+    selector.register(wakeup_r, selectors.EVENT_READ, 'reap')
+    selector.register(sys.stdin, selectors.EVENT_READ, 'stdin')
+    children = {}
+
+    print('ready', flush=True)
+    while True:
+        for key, _ in selector.select():
+            if key.data == 'stdin':
+                if not sys.stdin.readline():
+                    for pid in children:
+                        kill(pid)
+                    return
+            elif key.data == 'reap':
+                os.read(wakeup_r, 4096)
+                _reap(children)
+            else:
+                _fork(listener, children)
+        _reap(children)
+
+
+def _fork(listener, children):
+    """
+    Accept a request and fork a child for it
+    """
+    conn, _ = listener.accept()
+    fds = array.array('i')
+    msg, ancdata, _, _ = conn.recvmsg(65536, socket.CMSG_LEN(2 * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    request = json.loads(msg.decode('utf-8'))
+    out_fd, err_fd = fds
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for _conn in [listener, conn, *children.values()]:
+            _conn.close()
+        _run_child(request, out_fd, err_fd)
+
+    os.close(out_fd)
+    os.close(err_fd)
+    conn.sendall(f'{pid}\n'.encode('utf-8'))
+    children[pid] = conn
+
+
+def _reap(children):
+    """
+    Report the exit status of the finished children
+    """
+    for pid in list(children):
+        try:
+            done, status, usage = os.wait4(pid, os.WNOHANG)
+            reply = {'exit': exit_code(status), 'cpu': usage.ru_utime + usage.ru_stime,
+                     'rss': peak_rss(usage)}
+        except ChildProcessError:
+            done, reply = pid, {'exit': 0, 'cpu': None, 'rss': None}
+        if done == pid:
+            conn = children.pop(pid)
+            try:
+                conn.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+            except OSError:
+                pass
+            conn.close()
+
+
+class ForkServer():
+    """
+    Client side of the fork-server.
+    """
+    def __init__(self, preload=PRELOAD, limits=None):
+        self.directory = tempfile.mkdtemp(prefix='grader_fork_')
+        self.socket_path = os.path.join(self.directory, 'server.sock')
+        self.process = subprocess.Popen( # pylint: disable=consider-using-with
+            [sys.executable, os.path.abspath(__file__), self.socket_path, *preload],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        # the resource limits of the children (see utility.resource_limits)
+        self.limits = limits
+        if self.process.stdout.readline().strip() != 'ready':
+            self.close()
+            raise RuntimeError('The Python fork-server failed to start')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments,too-many-locals
+    def run(self, student_path, test_path, max_wait=30, expected=None, usage=None,
+            cancel=None):
+        """
+        Run a test file in a child forked for the student
+
+        @param student_path: The student's directory
+        @param test_path: The test file
+        @param max_wait: The maximum wait time (in seconds)
+        @param expected: The number of PASS/FAIL markers of the test (see execute_system_call)
+        @param usage: A list, the (CPU time, peak RSS, exit status) of the child is appended
+        @param cancel: A threading.Event, the child is killed when it is set
+        @return: The test output in the execute_system_call format
+        """
+        deadline = time() + max_wait
+        conn, out_r, err_r = self._request(student_path, test_path)
+        with conn:
+            capture = OutputCapture(expected=expected)
+            capture.start(os.fdopen(out_r, 'rb'), os.fdopen(err_r, 'rb'))
+
+            reply = conn.makefile('r', encoding='utf-8')
+            pid = int(reply.readline())
+            status = capture.wait(max(0, deadline - time()), cancel)
+            # the child closed its output, wait for its exit
+            stats = _read_reply(conn, reply, deadline - time()) if status == 'done' else None
+            if stats is None:
+                status = 'timeout' if status == 'done' else status
+                kill(pid)
+                stats = _read_reply(conn, reply, SERVER_WAIT)
+            kill_group(pid)
+            capture.join()
+
+        if usage is not None:
+            usage.append(stats and (stats['cpu'], stats['rss'], stats['exit']))
+        return capture.output(status)
+
+    def _request(self, student_path, test_path):
+        """
+        Send a request to the server with the write ends of the output pipes
+
+        @return: The connection and the read ends of the standard output and error pipes
+        """
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+            conn.sendmsg([json.dumps({'student_path': os.path.abspath(student_path),
+                                      'test_path': os.path.abspath(test_path),
+                                      'limits': self.limits}).encode('utf-8')],
+                         [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                           array.array('i', [out_w, err_w]))])
+        except OSError:
+            for _fd in (out_r, err_r):
+                os.close(_fd)
+            conn.close()
+            raise
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+        return conn, out_r, err_r
+
+    def close(self):
+        """
+        Stop the server and remove its socket
+        """
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=SERVER_WAIT)
+            except subprocess.TimeoutExpired:
+                kill(self.process.pid)
+                self.process.wait()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        os.rmdir(self.directory)
+
+
+def _read_reply(conn, reply, timeout):
+    """
+    Read the exit status and the resource usage of a child, None after the timeout
+    """
+    conn.settimeout(max(0, timeout))
+    try:
+        return json.loads(reply.readline())
+    except (socket.timeout, ValueError):
+        return None
+
+
+class PreloadTimeout(Exception):
+    """
+    The import of the student's module took too long
+    """
+
+
+def _preload_timeout(*args):
+    raise PreloadTimeout()
+
+
+def batch(request):
+    """
+    Run the tests of a student in forked children of this process, after importing the
+    preloaded modules and the student's module once. The result of every test is written as
+    a JSON line on the standard output.
+
+    @param request: The student_path, the tests (test file, expected markers, max_wait), the
+        max_wait of the import of the student's module, the module of the student, the
+        preload modules and the limits
+    """
+    results = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    # what the student's module prints when it is imported is not a test result
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    for _fd in (0, 1, 2):
+        os.dup2(null_fd, _fd)
+    os.close(null_fd)
+
+    os.chdir(request['student_path'])
+    sys.path[0] = request['student_path']
+    for module in request['preload']:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+    # a module failing to import is imported again by every test, which reports the error,
+    # a module whose import times out would time out again in every test
+    modules = set(sys.modules)
+    timed_out = False
+    signal.signal(signal.SIGALRM, _preload_timeout)
+    signal.alarm(max(1, int(request['max_wait'])))
+    try:
+        __import__(request['module'])
+    except BaseException as error: # pylint: disable=broad-exception-caught
+        timed_out = isinstance(error, PreloadTimeout)
+        for name in set(sys.modules) - modules:
+            del sys.modules[name]
+    finally:
+        signal.alarm(0)
+
+    for index, (test_path, expected, max_wait) in enumerate(request['tests']):
+        if timed_out:
+            output, usage = TIMEOUT_ERROR, None
+        else:
+            output, usage = _run_test(request, test_path, expected, max_wait)
+        results.write(json.dumps({'index': index, 'output': output, 'usage': usage}) + '\n')
+        results.flush()
+
+
+def _run_test(request, test_path, expected, max_wait):
+    """
+    Run a test in a forked child of the batch runner
+
+    @return: The test output in the execute_system_call format and the usage of the child
+    """
+    deadline = time() + max_wait
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.close(out_r)
+        os.close(err_r)
+        _run_child({'student_path': request['student_path'], 'test_path': test_path,
+                    'limits': request['limits'], 'keep_modules': True}, out_w, err_w)
+    os.close(out_w)
+    os.close(err_w)
+
+    capture = OutputCapture(expected=expected)
+    capture.start(os.fdopen(out_r, 'rb'), os.fdopen(err_r, 'rb'))
+    status = capture.wait(max(0, deadline - time()))
+    # the child closed its output, wait for its exit
+    usage = wait_pid(pid, deadline - time()) if status == 'done' else None
+    if usage is None:
+        status = 'timeout' if status == 'done' else status
+        kill(pid)
+        usage = wait_pid(pid)
+    kill_group(pid)
+    capture.join()
+    return capture.output(status), usage
+
+
+def _communicate(process, request, max_wait, cancel=None):
+    """
+    Send the request to the batch runner and read its output, the runner is killed after
+    max_wait seconds or when cancel is set (checked every CANCEL_POLL seconds)
+
+    @return: The output of the runner and whether it finished
+    """
+    deadline = time() + max_wait
+    while True:
+        wait = max(0, deadline - time())
+        try:
+            output, _ = process.communicate(
+                request, timeout=wait if cancel is None else min(wait, CANCEL_POLL))
+            return output, True
+        except subprocess.TimeoutExpired:
+            # the request is sent by the first call only
+            request = None
+            if time() >= deadline or (cancel is not None and cancel.is_set()):
+                kill(process.pid)
+                output, _ = process.communicate()
+                return output, False
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def run_batch(student_path, tests, max_wait=30, limits=None, module='hw00', preload=PRELOAD,
+              cancel=None):
+    """
+    Run the tests of a student in a batch runner
+
+    @param student_path: The student's directory
+    @param tests: The (test file, expected markers) pairs, or (test file, expected markers,
+        maximum wait time) to override max_wait
+    @param max_wait: The maximum wait time of every test (in seconds)
+    @param limits: The resource limits of the tests (see utility.resource_limits)
+    @param module: The student's module, imported once for all the tests
+    @param preload: The modules imported once for all the tests
+    @param cancel: A threading.Event, the runner is killed when it is set (the tests it did
+        not finish get a timeout)
+    @return: The (output, usage) of every test, see execute_system_call
+    """
+    student_path = os.path.abspath(student_path)
+    request = {'student_path': student_path, 'max_wait': max_wait, 'limits': limits,
+               'module': module, 'preload': list(preload),
+               'tests': [(os.path.abspath(test[0]), test[1],
+                          test[2] if len(test) > 2 else max_wait) for test in tests]}
+    with subprocess.Popen([sys.executable, os.path.abspath(__file__), '--batch'],
+                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, text=True,
+                          start_new_session=True) as process:
+        # the runner is not limited in CPU time, the tests have their own timeouts
+        apply_limits(process.pid, {name: value for name, value in (limits or {}).items()
+                                   if name != 'cpu'})
+        output, finished = _communicate(process, json.dumps(request), SERVER_WAIT + sum(
+            test_wait + GRACE_TIME for _, _, test_wait in request['tests']), cancel)
+        # the processes left running by the student's module
+        kill_group(process.pid)
+        missing = RUNTIME_ERROR if finished else TIMEOUT_ERROR
+
+    results = {}
+    for line in output.splitlines():
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue
+        results[result['index']] = (result['output'], result['usage'])
+    # the tests after a crash of the runner itself
+    return [results.get(index, (missing, None)) for index in range(len(tests))]
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == '--batch':
+        batch(json.loads(sys.stdin.read()))
+    else:
+        serve(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,136 @@
+"""
+On-disk cache of the grading results, keyed by the content of the submission and the tests.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+CACHE_VERSION = 5
+
+def hash_files(paths, digest=None):
+    """
+    Hash the names and the contents of the files
+
+    @param paths: The (name, path) pairs of the files
+    @param digest: The hash object to update (a new sha256 by default)
+    """
+    digest = hashlib.sha256() if digest is None else digest
+    for name, path in sorted(paths):
+        digest.update(name.encode('utf-8') + b'\0')
+        with open(path, 'rb') as file:
+            chunk = file.read(1 << 20)
+            while chunk:
+                digest.update(chunk)
+                chunk = file.read(1 << 20)
+        digest.update(b'\0')
+    return digest
+
+
+def student_files(student_dir):
+    """
+    List the (relative name, path) pairs of the student's files (the tests run in place,
+    a student's file named like a test is part of the submission)
+
+    @param student_dir: The student directory
+    """
+    files = []
+    for root, dirs, names in os.walk(student_dir):
+        dirs[:] = [_dir for _dir in dirs if _dir != '__pycache__']
+        for name in names:
+            path = os.path.join(root, name)
+            files.append((os.path.relpath(path, student_dir), path))
+    return files
+
+
+class ResultCache():
+    """
+    Cache of the grading results, the least recently used entries are evicted
+    once the cache is larger than max_size bytes.
+    """
+    def __init__(self, cache_dir, max_size=256 * 2**20):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self._entries())
+
+    def _entries(self):
+        """
+        List the paths of the cache entries
+        """
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def key(self, student_dir, test_paths, **config):
+        """
+        Compute the cache key of a grading
+
+        @param student_dir: The student directory
+        @param test_paths: The test files
+        @param config: Everything else the result depends on (runner, wait time, ...)
+        """
+        digest = hashlib.sha256(json.dumps([CACHE_VERSION, config], sort_keys=True)
+                                .encode('utf-8'))
+        hash_files([(os.path.basename(path), path) for path in test_paths], digest)
+        hash_files(student_files(student_dir), digest)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Get a cached result, None if there is none
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as entry:
+                item = tuple(json.load(entry))
+            os.utime(path)
+            return item
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, item):
+        """
+        Store a result and evict the oldest entries if the cache is too large
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(path),
+                                         suffix='.tmp', delete=False) as entry:
+            json.dump(list(item), entry)
+        os.replace(entry.name, path)
+
+        with self.lock:
+            self.size += os.path.getsize(path)
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is under 90% of max_size
+        """
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
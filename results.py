@@ -0,0 +1,187 @@
+"""
+Typed grading results, deduplicated by student ID as they arrive and written once.
+"""
+
+import csv
+import json
+import re
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from utility import MARKER, OUTPUT_LIMIT_ERROR, RUNTIME_ERROR, TIMEOUT_ERROR
+
+CSV_COLUMNS = ['Name', 'ID', 'Email', 'Language', 'Score', 'RunTime', 'CPUTime', 'PeakRSS',
+               'ExitStatus', 'Message']
+IMPLEMENTATION_ERROR = re.compile(r'\{\{Implementation Error\}\}@\[(.*?)\]', re.DOTALL)
+
+@dataclass
+class TestResult: # pylint: disable=too-many-instance-attributes
+    """
+    The outcome of a test file
+    """
+    test: str
+    passes: int = 0
+    fails: int = 0
+    # 'timeout', 'runtime', 'output-limit', 'implementation' or None
+    error: Optional[str] = None
+    message: str = ''
+    cpu_time: Optional[float] = None
+    peak_rss: Optional[int] = None
+    exit_status: Optional[int] = None
+
+    @classmethod
+    def from_output(cls, test, output, usage=None):
+        """
+        Build the result of a test from its output (see utility.format_output)
+
+        @param test: The test file name
+        @param output: The output of the runner
+        @param usage: The (CPU time, peak RSS, exit status) of the test
+        """
+        markers = MARKER.findall(output)
+        errors = IMPLEMENTATION_ERROR.findall(output)
+        error = None
+        for name, marker in (('timeout', TIMEOUT_ERROR), ('runtime', RUNTIME_ERROR),
+                             ('output-limit', OUTPUT_LIMIT_ERROR)):
+            if marker.strip() in output:
+                error = name
+        if error is None and errors:
+            error = 'implementation'
+        cpu_time, peak_rss, exit_status = usage or (None, None, None)
+        return cls(test, markers.count('PASS'), markers.count('FAIL'), error, ' '.join(errors),
+                   cpu_time, peak_rss, exit_status)
+
+
+@dataclass
+class GradeRecord: # pylint: disable=too-many-instance-attributes
+    """
+    The grade of a student's submission in one language
+    """
+    name: str
+    student_id: str
+    email: str
+    language: str
+    score: int
+    running_time: float
+    message: str
+    tests: List[TestResult] = field(default_factory=list)
+
+    @classmethod
+    def from_item(cls, student_info, item):
+        """
+        Build a record from the student information and a grading item
+        (cnt_passes, email, student_code, running_time, msg, tests), where tests are the
+        (test file, output, usage) of every test
+        """
+        cnt_passes, email, student_code, running_time, msg = item[:5]
+        tests = [TestResult.from_output(*test) for test in (item[5] if len(item) > 5 else [])]
+        return cls(str(student_info[0]), str(student_info[1]), email.strip(), student_code,
+                   cnt_passes, running_time, msg, tests)
+
+    def csv_row(self):
+        """
+        The row of the record in the CSV file, the per-test values are separated by '|'
+        """
+        def per_test(values, fmt):
+            return '|'.join('' if value is None else fmt(value) for value in values)
+
+        return [self.name, self.student_id, self.email, self.language, self.score,
+                f'{self.running_time:.2f}',
+                per_test((test.cpu_time for test in self.tests), lambda value: f'{value:.2f}'),
+                per_test((test.peak_rss for test in self.tests),
+                         lambda value: f'{value / 2**20:.1f}'),
+                per_test((test.exit_status for test in self.tests), str),
+                self.message.replace('PASS', 'P').replace('FAIL', 'F').strip()]
+
+
+def _id_order(student_id):
+    """
+    Sort the numeric IDs as numbers, before the other IDs
+    """
+    return (0, int(student_id), '') if student_id.isdigit() else (1, 0, student_id)
+
+
+class ResultTable():
+    """
+    The best record of every student ID: a record replaces the record of the same ID only if
+    its score is higher (the other language, a second submission), as the results arrive.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+
+    def add(self, student_info, data):
+        """
+        Add the grading items of a student (see GradeRecord.from_item)
+        """
+        with self.lock:
+            for item in data:
+                record = GradeRecord.from_item(student_info, item)
+                best = self.records.get(record.student_id)
+                if best is None or record.score > best.score:
+                    self.records[record.student_id] = record
+
+    def sorted_records(self):
+        """
+        The records in ID order
+        """
+        with self.lock:
+            return [self.records[key] for key in sorted(self.records, key=_id_order)]
+
+    def write(self, output_file, formats=()):
+        """
+        Write the records to a CSV file, and to the other formats next to it
+
+        @param output_file: The CSV file
+        @param formats: 'jsonl' (one JSON object per student) and/or 'parquet' (one row per
+            test, needs pyarrow or fastparquet)
+        @return: The written files
+        """
+        records = self.sorted_records()
+        with open(output_file, 'w', encoding='utf-8', newline='') as grades_file:
+            writer = csv.writer(grades_file)
+            writer.writerow(CSV_COLUMNS)
+            writer.writerows(record.csv_row() for record in records)
+
+        written = [output_file]
+        stem = output_file[:-4] if output_file.endswith('.csv') else output_file
+        for output_format in formats:
+            path = f'{stem}.{output_format}'
+            if output_format == 'jsonl':
+                write_jsonl(path, records)
+            elif output_format == 'parquet':
+                try:
+                    write_parquet(path, records)
+                except ImportError:
+                    # the grades are not lost for a missing optional dependency
+                    print(f'{path} not written, Parquet needs pyarrow or fastparquet')
+                    continue
+            else:
+                raise ValueError(f'unknown output format {output_format!r}')
+            written.append(path)
+        return written
+
+
+def write_jsonl(path, records):
+    """
+    Write the records as JSON lines
+    """
+    with open(path, 'w', encoding='utf-8') as jsonl_file:
+        for record in records:
+            jsonl_file.write(json.dumps(asdict(record)) + '\n')
+
+
+def write_parquet(path, records):
+    """
+    Write the records as a Parquet table with one row per test
+    """
+    import pandas as pd # pylint: disable=import-outside-toplevel
+
+    rows = []
+    for record in records:
+        student = {key: value for key, value in asdict(record).items() if key != 'tests'}
+        for test in record.tests or [None]:
+            rows.append({**student, **({f'test_{key}': value for key, value in
+                                        asdict(test).items()} if test else {})})
+    pd.DataFrame(rows).to_parquet(path, index=False)
@@ -0,0 +1,63 @@
+"""
+Scheduling of the tests: the timing-sensitive tests run alone, the others concurrently.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from utility import read_test_options
+
+SHARED = 'shared'
+EXCLUSIVE = 'exclusive'
+
+def read_schedule(test_path):
+    """
+    The scheduling class of a test file, declared in its header (see read_test_options):
+    ``# grader: schedule=exclusive`` for a test measuring the wall-clock time
+
+    @return: SHARED or EXCLUSIVE
+    """
+    schedule = read_test_options(test_path).get('schedule', SHARED)
+    if schedule not in (SHARED, EXCLUSIVE):
+        raise ValueError(f'{test_path}: unknown schedule {schedule!r}, '
+                         f'expected {SHARED!r} or {EXCLUSIVE!r}')
+    return schedule
+
+
+class Scheduler(): # pylint: disable=too-few-public-methods
+    """
+    Readers-writer lock of the test runs: any number of shared tests run at the same time,
+    an exclusive test waits for them to finish and runs alone. A waiting exclusive test
+    holds back the new shared tests, so that it is not starved by the grading threads.
+    """
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.shared = 0
+        self.exclusive = False
+        self.waiting = 0
+
+    @contextmanager
+    def run(self, schedule=SHARED):
+        """
+        Hold the scheduler for a test run
+
+        @param schedule: SHARED or EXCLUSIVE (see read_schedule)
+        """
+        with self.changed:
+            if schedule == EXCLUSIVE:
+                self.waiting += 1
+                self.changed.wait_for(lambda: not self.exclusive and self.shared == 0)
+                self.waiting -= 1
+                self.exclusive = True
+            else:
+                self.changed.wait_for(lambda: not self.exclusive and self.waiting == 0)
+                self.shared += 1
+        try:
+            yield
+        finally:
+            with self.changed:
+                if schedule == EXCLUSIVE:
+                    self.exclusive = False
+                else:
+                    self.shared -= 1
+                self.changed.notify_all()
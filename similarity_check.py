@@ -2,11 +2,24 @@
 check similarity
 """
 
+from plagiarism_index import check_archive
 from utility import detect_similarity
 
 # Check the similarity between files under a directory
 # The first argument is the submission directory
 # The second argument is the homework string (hw00, hw01, etc.)
 # The third argument is the threshold for similarity (0.0 to 1.0)
+# method='fingerprint' compares normalized token fingerprints instead of the words, which
+# survive renamed variables and reformatted code, template_dir='template' removes the
+# template code (template/hw00.m, template/hw00.py) from the comparison
 
-detect_similarity('submissions', 'hw00', 0.92)
+# Check the submissions against the index of the previous homeworks and semesters
+# (and add them to the index)
+# The arguments are the submission directory, the homework string, the index file,
+# the course, the term and the threshold for the estimated similarity (0.0 to 1.0)
+
+# the fingerprints are computed by a process pool, which imports this file again on
+# Windows and macOS
+if __name__ == '__main__':
+    detect_similarity('submissions', 'hw00', 0.92)
+    check_archive('submissions', 'hw00', 'plagiarism_index.sqlite', 'course', 'term', 0.8)
@@ -0,0 +1,124 @@
+"""
+Similarity report: the flagged students grouped in clusters (the connected components of
+the similarity graph), an index of the clusters, a page per cluster with its pairs and a
+side-by-side diff of every pair. Every page stays small whatever the size of the cohort.
+"""
+
+import difflib
+import html
+import os
+import re
+
+STYLE = """<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; margin-bottom: 2em; }
+th, td { border: 1px solid #ccc; padding: 4px 8px; text-align: left; vertical-align: top; }
+th { background: #eee; }
+</style>"""
+# the cluster and diff pages (<language>_<cluster>.html, <language>_<cluster>_<pair>.html)
+REPORT_PAGE = re.compile(r'\w+?_\d+(?:_\d+)?\.html')
+
+def similarity_clusters(graph):
+    """
+    The clusters of similar students, the largest first
+
+    @param graph: The similarity graph (see check_similarity), the scores in the 'title'
+        of the edges
+    @return: The (members, pairs) of every cluster, the pairs (first, second, score)
+        sorted by decreasing score
+    """
+    import networkx as nx # pylint: disable=import-outside-toplevel
+
+    clusters = []
+    for component in nx.connected_components(graph):
+        pairs = sorted(((first, second, float(score)) for first, second, score
+                        in graph.subgraph(component).edges(data='title')),
+                       key=lambda pair: pair[2], reverse=True)
+        clusters.append((sorted(component), pairs))
+    return sorted(clusters, key=lambda cluster: (-len(cluster[0]), -cluster[1][0][2]))
+
+
+def _page(title, body):
+    """
+    An HTML page
+    """
+    title = html.escape(title)
+    return (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{title}</title>\n'
+            f'{STYLE}</head>\n<body>\n<h1>{title}</h1>\n{body}</body></html>\n')
+
+
+def _table(header, rows):
+    """
+    An HTML table, the cells of the rows are already escaped
+    """
+    head = ''.join(f'<th>{html.escape(column)}</th>' for column in header)
+    body = ''.join('<tr>' + ''.join(f'<td>{cell}</td>' for cell in row) + '</tr>\n'
+                   for row in rows)
+    return f'<table>\n<tr>{head}</tr>\n{body}</table>\n'
+
+
+def _remove_pages(report_dir):
+    """
+    Remove the cluster and diff pages of a previous report, the other files of report_dir
+    are kept
+    """
+    for name in os.listdir(report_dir):
+        if REPORT_PAGE.fullmatch(name):
+            os.remove(os.path.join(report_dir, name))
+
+
+def _write(path, text):
+    """
+    Write a page of the report
+    """
+    with open(path, 'w', encoding='utf-8') as page:
+        page.write(text)
+
+
+# pylint: disable-next=too-many-locals
+def write_report(report_dir, graphs, documents, context=3):
+    """
+    Write the similarity report: report_dir/index.html lists the clusters of every
+    language, report_dir/<language>_<cluster>.html the members and pairs of a cluster,
+    report_dir/<language>_<cluster>_<pair>.html the side-by-side diff of a pair
+
+    @param report_dir: The directory of the report
+    @param graphs: The similarity graph of every language (see check_similarity)
+    @param documents: The documents of the students of every language, by student name
+    @param context: The number of unchanged lines around the differences of a diff
+    @return: The path of the index
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    # a previous report may have more clusters
+    _remove_pages(report_dir)
+    differ = difflib.HtmlDiff(wrapcolumn=100)
+    index = ''
+    for language, graph in graphs.items():
+        clusters = similarity_clusters(graph)
+        index += (f'<h2>{html.escape(language)}</h2>\n<p>{graph.number_of_nodes()} students, '
+                  f'{graph.number_of_edges()} pairs, {len(clusters)} clusters</p>\n')
+        rows = []
+        for number, (members, pairs) in enumerate(clusters, 1):
+            cluster_page = f'{language}_{number}.html'
+            pair_rows = []
+            for pair_number, (first, second, score) in enumerate(pairs, 1):
+                diff_page = f'{language}_{number}_{pair_number}.html'
+                _write(os.path.join(report_dir, diff_page), differ.make_file(
+                    documents[language][first].splitlines(),
+                    documents[language][second].splitlines(),
+                    first, second, context=True, numlines=context))
+                pair_rows.append((html.escape(first), html.escape(second), f'{score:.3f}',
+                                  f'<a href="{diff_page}">diff</a>'))
+            _write(os.path.join(report_dir, cluster_page), _page(
+                f'{language} cluster {number}',
+                '<p><a href="index.html">index</a></p>\n<h2>Members</h2>\n<p>' +
+                ', '.join(html.escape(member) for member in members) + '</p>\n' +
+                '<h2>Pairs</h2>\n' + _table(('first', 'second', 'score', ''), pair_rows)))
+            rows.append((f'<a href="{cluster_page}">{number}</a>', str(len(members)),
+                         f'{pairs[0][2]:.3f}',
+                         ', '.join(html.escape(member) for member in members)))
+        index += _table(('cluster', 'students', 'max score', 'members'), rows)
+
+    index_path = os.path.join(report_dir, 'index.html')
+    _write(index_path, _page('Similarity report', index))
+    return index_path
@@ -0,0 +1,117 @@
+"""
+Read the student submissions in place from the Canvas export.
+
+The student zip files are read from the submission file (inflated once into memory or a
+temporary file), instead of extracting the whole export to disk first, and only the files
+relevant to grading are written out.
+"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+# the files relevant to grading, '' is a file without extension (a misnamed submission)
+CODE_EXTENSIONS = ('.m', '.py', '.ipynb', '.asv')
+EXTRA_EXTENSIONS = ('', '.txt', '.csv', '.dat', '.mat', '.json')
+SKIP_DIRS = ('.git', '__MACOSX', '__pycache__', '.ipynb_checkpoints', 'node_modules')
+MAX_FILE_SIZE = 8 * 2**20
+# the size of a student's zip file kept in memory, a larger one is spooled to a temporary file
+SPOOL_SIZE = 32 * 2**20
+
+def is_relevant(zip_info, extensions=CODE_EXTENSIONS + EXTRA_EXTENSIONS,
+                max_size=MAX_FILE_SIZE):
+    """
+    Check if a member of a student's zip file is needed for grading
+
+    @param zip_info: The member of the zip file
+    @param extensions: The allowed file extensions
+    @param max_size: The maximum (uncompressed) file size
+    """
+    if zip_info.is_dir() or zip_info.file_size > max_size:
+        return False
+    parts = zip_info.filename.replace('\\', '/').split('/')
+    if any(part in SKIP_DIRS for part in parts[:-1]) or parts[-1].startswith('._'):
+        return False
+    return os.path.splitext(parts[-1])[1].lower() in extensions
+
+
+def extract_relevant(zip_ref, file_dir, extensions=CODE_EXTENSIONS + EXTRA_EXTENSIONS,
+                     max_size=MAX_FILE_SIZE):
+    """
+    Extract the relevant files of a student's zip file, without their directories
+    (like utility.unzip), the other members are never inflated
+
+    @param zip_ref: The student's zip file (a zipfile.ZipFile)
+    @param file_dir: The student directory
+    @param extensions: The allowed file extensions
+    @param max_size: The maximum (uncompressed) file size
+    """
+    os.makedirs(file_dir, exist_ok=True)
+    for zip_info in zip_ref.infolist():
+        if not is_relevant(zip_info, extensions, max_size):
+            continue
+        zip_info.filename = os.path.basename(zip_info.filename.replace('\\', '/'))
+        zip_ref.extract(zip_info, file_dir)
+
+
+def remove_test_copies(student_dir, tests):
+    """
+    Remove the student's copies of the test files: the tests run in place from the test
+    directory, but MATLAB runs the files of the current folder (the student's) first
+
+    @param student_dir: The student directory
+    @param tests: The test file names
+    """
+    for _test in tests:
+        path = os.path.join(student_dir, _test)
+        if os.path.lexists(path):
+            os.remove(path)
+
+
+class SubmissionArchive():
+    """
+    The Canvas export (one zip file with a zip file or a link file per student).
+    """
+    def __init__(self, submission_file, extensions=CODE_EXTENSIONS + EXTRA_EXTENSIONS,
+                 max_size=MAX_FILE_SIZE):
+        self.submission_file = submission_file
+        self.extensions = extensions
+        self.max_size = max_size
+
+    def members(self, extension):
+        """
+        List the members of the export with the extension
+        """
+        with zipfile.ZipFile(self.submission_file, 'r') as outer:
+            return [zip_info.filename for zip_info in outer.infolist()
+                    if not zip_info.is_dir() and zip_info.filename.endswith(extension)]
+
+    def extract_links(self, submission_dir):
+        """
+        Extract the link (.html) submissions to the submission directory
+        """
+        os.makedirs(submission_dir, exist_ok=True)
+        with zipfile.ZipFile(self.submission_file, 'r') as outer:
+            for member in self.members('.html'):
+                zip_info = outer.getinfo(member)
+                zip_info.filename = os.path.basename(member)
+                outer.extract(zip_info, submission_dir)
+
+    def extract_student(self, member, student_dir):
+        """
+        Extract the relevant files of a student's zip file, read from the export
+
+        @param member: The student's zip file in the export
+        @param student_dir: The student directory
+        """
+        # every call opens its own handle, so that students can be extracted concurrently
+        with zipfile.ZipFile(self.submission_file, 'r') as outer, \
+                outer.open(member) as nested_file, \
+                tempfile.SpooledTemporaryFile(SPOOL_SIZE) as spool:
+            # the student's zip file is inflated once, sequentially: reading it in place
+            # would inflate it again from its start at every seek of the zip reader
+            shutil.copyfileobj(nested_file, spool, 2**20)
+            spool.seek(0)
+            with zipfile.ZipFile(spool, 'r') as nested:
+                extract_relevant(nested, student_dir, self.extensions, self.max_size)
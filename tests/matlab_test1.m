@@ -1,3 +1,4 @@
+% grader: expect=10
 hw00_worker = hw00();
 
 hw_assert(hw00_worker.p1(0) == 0)
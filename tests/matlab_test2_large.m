@@ -1,3 +1,4 @@
+% grader: expect=5
 hw00_worker = hw00();
 
 hw_assert(hw00_worker.p2(5 * eye(3)) == 125)
@@ -1,3 +1,4 @@
+% grader: schedule=exclusive expect=10
 hw00_worker = hw00();
 
 for i = 1:10
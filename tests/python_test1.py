@@ -1,3 +1,4 @@
+# grader: expect=10
 from hw00 import p1
 import numpy as np
 import time
@@ -1,3 +1,4 @@
+# grader: schedule=exclusive expect=10
 from hw00 import p3
 import numpy as np
 import time
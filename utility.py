@@ -5,46 +5,417 @@ Utility functions.
 
 import os
 import re
+import selectors
+import shutil
+import signal
+import stat
 import zipfile
 import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from time import time, sleep
 import psutil
-import pandas as pd
-from bs4 import BeautifulSoup
-from sklearn.feature_extraction.text import TfidfVectorizer
-from pyvis.network import Network
-import networkx as nx
+
+# BeautifulSoup, scikit-learn and networkx are imported by the functions
+# using them, so that the grader (and every grading process) starts without them
+
+TIMEOUT_ERROR = '  {{TimeOut Error}}  '
+RUNTIME_ERROR = '  {{RunTime Error}}  '
+OUTPUT_LIMIT_ERROR = '  {{Output Limit Error}}  '
+
+# the maximum output of a test (bytes per stream), and the time a test may keep running
+# after it printed its expected number of PASS/FAIL markers
+MAX_OUTPUT = 2**20
+GRACE_TIME = 2
+LINE_SIZE = 2**16
+# how often a cancellable test checks its cancel event (in seconds)
+CANCEL_POLL = 0.1
+MARKER = re.compile('PASS|FAIL')
+
+# the resource limits of the tests (see Grader), by name
+RLIMITS = {'memory': 'RLIMIT_AS', 'cpu': 'RLIMIT_CPU', 'files': 'RLIMIT_NOFILE',
+           'processes': 'RLIMIT_NPROC'}
+OPTION = re.compile(r'^\s*(?:#|%)\s*grader:(.*)$')
+
+def read_test_options(test_path, max_lines=20):
+    """
+    Read the grader options in the header of a test file, the comment lines like
+    ``# grader: expect=3`` (``% grader: expect=3`` in MATLAB)
+
+    @return: The options, {'expect': '3'}
+    """
+    options = {}
+    try:
+        with open(test_path, 'r', encoding='utf-8', errors='replace') as test_file:
+            for _, line in zip(range(max_lines), test_file):
+                match = OPTION.match(line)
+                if match:
+                    for option in match.group(1).split():
+                        key, _, value = option.partition('=')
+                        options[key] = value
+    except OSError:
+        pass
+    return options
+
+
+def expected_markers(test_path):
+    """
+    The number of PASS/FAIL markers a test prints (the expect option), None if unknown
+    """
+    try:
+        return int(read_test_options(test_path)['expect'])
+    except (KeyError, ValueError):
+        return None
 
 def kill(proc_pid):
     """
-    kill the process with the given PID
+    kill the process with the given PID, its children and its process group (the processes
+    it left running, detached from it, when it leads its own session)
+    """
+    try:
+        process = psutil.Process(proc_pid)
+        for proc in process.children(recursive=True):
+            proc.kill()
+        process.kill()
+    except psutil.NoSuchProcess:
+        pass
+    kill_group(proc_pid)
+
+def kill_group(pgid):
+    """
+    kill the process group of a test (started in its own session), the processes the test
+    left running are killed even after the test itself exited
+    """
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except OSError:
+            pass # not the leader of a process group, or the group is gone
+
+class OutputCapture(): # pylint: disable=too-many-instance-attributes
+    """
+    Parse the output streams of a test line by line while it runs. Only the PASS/FAIL
+    markers of the standard output and the first max_bytes of the standard error are kept,
+    and a stream longer than max_bytes stops the test, so the memory of the grader does not
+    grow with the output of the tests.
+    """
+    def __init__(self, max_bytes=MAX_OUTPUT, expected=None):
+        self.max_bytes = max_bytes
+        self.expected = expected
+        self.markers = []
+        self.errors = []
+        self.sizes = {'out': 0, 'err': 0}
+        self.open_streams = 0
+        self.overflow = False
+        self.complete_time = None
+        self.changed = threading.Condition()
+        self.readers = []
+        self.stopped = False
+
+    def start(self, out_stream, err_stream):
+        """
+        Read the (binary) streams in background threads, they are closed at their end
+        """
+        self.open_streams = 2
+        self.readers = [threading.Thread(target=self._read, args=(name, stream), daemon=True)
+                        for name, stream in (('out', out_stream), ('err', err_stream))]
+        for reader in self.readers:
+            reader.start()
+
+    def _read(self, name, stream):
+        """
+        Parse a stream until its end, or until the capture is stopped (see join), the lines
+        after the overflow are discarded
+        """
+        with stream:
+            if os.name == 'nt':
+                # the pipes cannot be polled on Windows
+                for line in iter(lambda: stream.readline(LINE_SIZE), b''):
+                    self.feed(name, line)
+            else:
+                self._poll(name, stream)
+        with self.changed:
+            self.open_streams -= 1
+            self.changed.notify_all()
+
+    def _poll(self, name, stream):
+        """
+        Read a stream by polling it, so that a reader is stopped even if a process left by
+        the test holds the stream open (a blocked readline could not be interrupted)
+        """
+        pending = b''
+        with selectors.DefaultSelector() as selector:
+            selector.register(stream, selectors.EVENT_READ)
+            while not self.stopped:
+                if not selector.select(CANCEL_POLL):
+                    continue
+                data = os.read(stream.fileno(), LINE_SIZE)
+                if not data:
+                    break
+                *lines, pending = (pending + data).split(b'\n')
+                for line in lines:
+                    self.feed(name, line + b'\n')
+                if len(pending) >= LINE_SIZE:
+                    self.feed(name, pending)
+                    pending = b''
+        if pending:
+            self.feed(name, pending)
+
+    def feed(self, name, line):
+        """
+        Parse a line of a stream
+        """
+        with self.changed:
+            if self.overflow:
+                return
+            self.sizes[name] += len(line)
+            if self.sizes[name] > self.max_bytes:
+                self.overflow = True
+            elif name == 'out':
+                self.markers += MARKER.findall(line.decode('utf-8', errors='replace'))
+                if self.expected is not None and self.complete_time is None \
+                        and len(self.markers) >= self.expected:
+                    self.complete_time = time()
+            else:
+                self.errors.append(line.decode('utf-8', errors='replace'))
+            self.changed.notify_all()
+
+    def wait(self, max_wait, cancel=None):
+        """
+        Wait for the end of the streams
+
+        @param cancel: A threading.Event, set to stop waiting
+        @return: 'done' at the end of the streams, 'timeout' after max_wait seconds,
+            'overflow' when a stream is too long, 'complete' when the test printed its
+            expected markers GRACE_TIME seconds ago but did not finish, 'cancelled' when
+            cancel is set
+        """
+        deadline = time() + max_wait
+        with self.changed:
+            while True:
+                if self.open_streams == 0:
+                    return 'done'
+                if self.overflow:
+                    return 'overflow'
+                if cancel is not None and cancel.is_set():
+                    return 'cancelled'
+                now, wake = time(), deadline
+                if self.complete_time is not None:
+                    if now >= self.complete_time + GRACE_TIME:
+                        return 'complete'
+                    wake = min(wake, self.complete_time + GRACE_TIME)
+                if now >= deadline:
+                    return 'timeout'
+                if cancel is not None:
+                    wake = min(wake, now + CANCEL_POLL)
+                self.changed.wait(wake - now)
+
+    def join(self, timeout=GRACE_TIME):
+        """
+        Wait for the reader threads (once the test is over), a process left running by the
+        test may hold the streams open: the readers are stopped after timeout seconds
+
+        @param timeout: The maximum wait time (in seconds), None to wait for the end of
+            the streams
+        """
+        deadline = None if timeout is None else time() + timeout
+        for reader in self.readers:
+            reader.join(None if deadline is None else max(0, deadline - time()))
+        self.stopped = True
+        for reader in self.readers:
+            reader.join()
+
+    def output(self, status='done'):
+        """
+        Format the output of the test (see format_output) for its final status
+        """
+        if status == 'timeout':
+            return TIMEOUT_ERROR
+        output = format_output(''.join(self.markers), ''.join(self.errors))
+        if status == 'overflow':
+            output += OUTPUT_LIMIT_ERROR
+        return output
+
+
+def resource_limits(limits):
+    """
+    Convert the resource limits to (resource, (soft, hard)) pairs, the limits unknown to the
+    platform are skipped
+
+    @param limits: The limits by name (see RLIMITS): the address space in bytes, the CPU
+        time in seconds, the number of open files and the number of processes (of the user)
+    """
+    try:
+        import resource # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return []
+    pairs = []
+    for name, value in (limits or {}).items():
+        if value is None or not hasattr(resource, RLIMITS[name]):
+            continue
+        # the CPU time limit sends SIGXCPU, the process is killed one second later
+        hard = value + 1 if name == 'cpu' else value
+        pairs.append((getattr(resource, RLIMITS[name]), (value, hard)))
+    return pairs
+
+
+def apply_limits(pid, limits):
+    """
+    Apply the resource limits to a running process (prlimit, only on Linux)
+    """
+    pairs = resource_limits(limits)
+    if not pairs or not hasattr(psutil.Process, 'rlimit'):
+        return
+    try:
+        process = psutil.Process(pid)
+        for limit, values in pairs:
+            process.rlimit(limit, values)
+    except (psutil.NoSuchProcess, ValueError):
+        pass
+
+
+def exit_code(status):
+    """
+    Convert a wait status to an exit code (negative for a signal)
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def peak_rss(usage):
+    """
+    The peak resident set size (in bytes) of a resource usage
+    """
+    return usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def wait_usage(process, timeout=None):
+    """
+    Wait for a process (like Popen.wait) and measure its resource usage
+
+    @return: The CPU time (in seconds), the peak RSS (in bytes) and the exit status of the
+        process, the CPU time and the peak RSS are None on platforms without os.wait4
+    """
+    if not hasattr(os, 'wait4'):
+        return None, None, process.wait(timeout)
+    stats = wait_pid(process.pid, timeout)
+    if stats is None:
+        raise subprocess.TimeoutExpired(process.args, timeout)
+    process.returncode = stats[2]
+    return stats
+
+
+def wait_pid(pid, timeout=None):
+    """
+    Wait for a child process with os.wait4 and measure its resource usage
+
+    @return: The CPU time (in seconds), the peak RSS (in bytes) and the exit status of the
+        process, None after the timeout
     """
-    process = psutil.Process(proc_pid)
-    for proc in process.children(recursive=True):
-        proc.kill()
-    process.kill()
+    deadline = None if timeout is None else time() + timeout
+    delay = 0.0005
+    while True:
+        done, status, usage = os.wait4(pid, 0 if deadline is None else os.WNOHANG)
+        if done == pid:
+            return usage.ru_utime + usage.ru_stime, peak_rss(usage), exit_code(status)
+        if time() >= deadline:
+            return None
+        delay = min(delay * 2, 0.05, max(0, deadline - time()))
+        sleep(delay)
 
-def execute_system_call(command, max_wait=30):
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def execute_system_call(command, max_wait=30, expected=None, limits=None, usage=None,
+                        cancel=None, cwd=None, env=None):
     """
     Execute a system call and return the output
+
+    @param expected: The number of PASS/FAIL markers of the test, the test is stopped
+        GRACE_TIME seconds after printing them
+    @param limits: The resource limits of the process (see resource_limits)
+    @param usage: A list, the (CPU time, peak RSS, exit status) of the process is appended
+    @param cancel: A threading.Event, the process is killed when it is set
+    @param cwd: The working directory of the process
+    @param env: The environment of the process
     """
+    deadline = time() + max_wait
     with subprocess.Popen(command,
                     stdout = subprocess.PIPE,
                     stderr = subprocess.PIPE,
-                    text = True,
-                    shell = False
+                    shell = False,
+                    cwd = cwd,
+                    env = env,
+                    # the processes left by the test are killed with its process group
+                    start_new_session = True
                     ) as process:
-        try:
-            std_out, std_err = process.communicate(timeout=max_wait)
-            output = ''.join(re.findall('PASS|FAIL', std_out.strip()))
-            if std_err:
-                output += '  {{Implementation Error}}@[' + \
-                    std_err.strip().replace('\n','').replace(',', '') + ']'
-            return output
-        except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as err:
-            if isinstance(err, subprocess.TimeoutExpired):
-                kill(process.pid)
-                return '  {{TimeOut Error}}  '
-            return '  {{RunTime Error}}  '
+        apply_limits(process.pid, limits)
+        capture = OutputCapture(expected=expected)
+        capture.start(process.stdout, process.stderr)
+        status = capture.wait(max_wait, cancel)
+        stats = None
+        if status == 'done':
+            try:
+                stats = wait_usage(process, max(0, deadline - time()))
+            except subprocess.TimeoutExpired:
+                status = 'timeout'
+        if status != 'done':
+            kill(process.pid)
+            stats = wait_usage(process)
+        kill_group(process.pid)
+        capture.join()
+        if usage is not None:
+            usage.append(stats)
+        return capture.output(status)
+
+@contextmanager
+def read_only(paths):
+    """
+    Remove the write permissions of the files, and restore them on exit
+    """
+    modes = {}
+    try:
+        for path in paths:
+            modes[path] = os.stat(path).st_mode
+            os.chmod(path, modes[path] & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        yield
+    finally:
+        for path, mode in modes.items():
+            os.chmod(path, stat.S_IMODE(mode))
+
+
+def link_or_copy(source, destination):
+    """
+    Make destination a hard link of source (a copy where hard links are not supported)
+    """
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            return
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy(source, destination)
+
+def python_path(*paths):
+    """
+    The environment of a Python process importing modules from paths first (PYTHONPATH)
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    if os.environ.get('PYTHONPATH'):
+        paths.append(os.environ['PYTHONPATH'])
+    return {**os.environ, 'PYTHONPATH': os.pathsep.join(paths)}
+
+def format_output(std_out, std_err):
+    """
+    Format the output of a test as its PASS/FAIL markers followed by the error message
+    """
+    output = ''.join(re.findall('PASS|FAIL', std_out.strip()))
+    if std_err:
+        output += '  {{Implementation Error}}@[' + \
+            std_err.strip().replace('\n','') + ']'
+    return output
 
 def find_emails(text):
     """
@@ -61,6 +432,8 @@ def extract_link(link_file_path):
     """
     Extract HTML content to a link using BeautifulSoup.
     """
+    from bs4 import BeautifulSoup # pylint: disable=import-outside-toplevel
+
     with open(link_file_path, 'r', encoding='utf-8') as link_file:
         index = link_file.read()
         link = BeautifulSoup(index, 'lxml').body.a['href']
@@ -88,25 +461,23 @@ def unzip(file, file_dir, skip_dir=True):
                 zip_info.filename = os.path.basename(zip_info.filename)
                 zip_ref.extract(zip_info, file_dir)
 
-def remove_duplicates(csv_file):
-    """
-    Remove duplicate IDs (remain the maximum score value) in the CSV file with panda
-    """
-    # Read the CSV file
-    data_frame = pd.read_csv(csv_file)
-
-    # Remove duplicate IDs (remain the maximum score value)
-    data_frame = data_frame.sort_values('Score', ascending=False)\
-                .drop_duplicates('ID').sort_values('ID')
-
-    # Write the updated data to the CSV file
-    data_frame.to_csv(csv_file, index=False)
-
-
-def detect_similarity(submission_dir, hw_str, threshold):
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments,too-many-locals
+def detect_similarity(submission_dir, hw_str, threshold, method='tfidf', template_dir=None,
+                      cache_dir='.fingerprint_cache', jobs=None, report_dir='similarity_report'):
     """
     check the similarity between files under a directory.
+
+    @param method: 'tfidf' compares the words of the files, 'fingerprint' compares their
+        normalized token fingerprints (see fingerprint.py), which survive renaming,
+        reformatting and reordering
+    @param template_dir: The directory of the template code given to the students
+        (hw_str.m, hw_str.py), not counted as similar by the 'fingerprint' method
+    @param cache_dir: The cache of the fingerprints of the files
+    @param jobs: The number of processes computing the fingerprints
+    @param report_dir: The directory of the report (see similarity_report.py)
+    @return: The path of the index of the report
     """
+    from similarity_report import write_report # pylint: disable=import-outside-toplevel
 
     matlab_documents = []
     matlab_users = []
@@ -127,38 +498,114 @@ def detect_similarity(submission_dir, hw_str, threshold):
                     python_documents.append( file.read() )
                     python_users.append(student_dir)
 
-    network = Network('1200px', '1200px')
+    vectors = {'matlab': None, 'python': None}
+    if method == 'fingerprint':
+        # pylint: disable-next=import-outside-toplevel
+        from fingerprint import fingerprint_documents, fingerprint_vectors
+        for language, extension, documents in (('matlab', '.m', matlab_documents),
+                                               ('python', '.py', python_documents)):
+            template = []
+            template_file = os.path.join(template_dir or '', hw_str + extension)
+            if template_dir and os.path.exists(template_file):
+                with open(template_file, 'r', encoding='utf-8') as file:
+                    template = fingerprint_documents([file.read()], language)[0]
+            vectors[language] = fingerprint_vectors(
+                fingerprint_documents(documents, language, cache_dir, jobs), template)
 
-    g_matlab = check_similarity(matlab_documents, matlab_users, threshold)
-    nx.draw(g_matlab, with_labels = True)
-    network.from_nx(g_matlab)
-    network.show('matlab.html', notebook=False)
+    graphs, named_documents = {}, {}
+    for language, documents, users in (('matlab', matlab_documents, matlab_users),
+                                       ('python', python_documents, python_users)):
+        # a language with less than two submissions has no pairs to compare
+        if len(documents) < 2:
+            continue
+        graphs[language] = check_similarity(documents, users, threshold,
+                                            vectors=vectors[language])
+        # the nodes of the graphs are the student names (see check_similarity)
+        named_documents[language] = {user.split('_')[0]: document
+                                     for user, document in zip(users, documents)}
 
+    index = write_report(report_dir, graphs, named_documents)
+    print(f'Similarity report: {index}')
+    return index
 
-    network = Network('1200px', '1200px')
 
-    g_python = check_similarity(python_documents, python_users, threshold)
-    nx.draw(g_python, with_labels = True)
-    network.from_nx(g_python)
-    network.show('python.html', notebook=False)
+def similar_pairs(vectors, threshold, top_k=None, block_size=256):
+    """
+    Find the pairs of documents whose similarity is above the threshold.
 
+    The similarities are computed by blocks of block_size documents against all the
+    documents, so that the memory stays bounded (block_size x (documents + vocabulary)
+    floats), and the pairs above the threshold are extracted from each block at once.
 
-def check_similarity(documents, users, threshold):
+    @param vectors: The (sparse, L2-normalized) document vectors, one row per document
+    @param threshold: The similarity threshold
+    @param top_k: Only keep the top_k most similar documents of every document
+    @param block_size: The number of documents in a block
+    @return: The arrays of the first documents, the second documents (first < second)
+        and the similarities
     """
-    check the similarity between documents.
+    import numpy as np # pylint: disable=import-outside-toplevel
+
+    n_documents = vectors.shape[0]
+    vectors = vectors.tocsr()
+    blocks = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))]
+
+    for start in range(0, n_documents, block_size):
+        # the similarities of all the documents (rows) with the documents of the block
+        similarity = np.asarray(vectors @ vectors[start:start + block_size].T.toarray())
+        seconds, firsts = np.nonzero(similarity > threshold)
+        scores = similarity[seconds, firsts]
+        firsts = firsts + start
+        if top_k is None:
+            keep = seconds > firsts
+            blocks.append((firsts[keep], seconds[keep], scores[keep]))
+        else:
+            keep = seconds != firsts
+            blocks.append(_top_k(firsts[keep], seconds[keep], scores[keep], top_k))
+
+    firsts, seconds, scores = (np.concatenate(arrays) for arrays in zip(*blocks))
+    if top_k is not None:
+        # a pair can be in the top_k of both documents
+        _, unique = np.unique(firsts * n_documents + seconds, return_index=True)
+        firsts, seconds, scores = firsts[unique], seconds[unique], scores[unique]
+    return firsts, seconds, scores
+
+
+def _top_k(rows, cols, data, top_k):
+    """
+    Keep the top_k largest entries of every row, as pairs (smaller index first)
     """
+    import numpy as np # pylint: disable=import-outside-toplevel
+
+    # rank the entries of every row by decreasing similarity
+    order = np.lexsort((-data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    _, row_starts, row_counts = np.unique(rows, return_index=True, return_counts=True)
+    keep = np.arange(len(rows)) - np.repeat(row_starts, row_counts) < top_k
+    rows, cols, data = rows[keep], cols[keep], data[keep]
+    return np.minimum(rows, cols), np.maximum(rows, cols), data
 
-    tfidf = TfidfVectorizer().fit_transform(documents)
 
-    pairwise_similarity = tfidf * tfidf.T
+def check_similarity(documents, users, threshold, top_k=None, vectors=None):
+    """
+    check the similarity between documents.
+
+    @param top_k: Only link every student to the top_k most similar students
+    @param vectors: The L2-normalized vectors of the documents (tf-idf of the documents
+        by default)
+    """
+    import networkx as nx # pylint: disable=import-outside-toplevel
+
+    if vectors is None:
+        # pylint: disable-next=import-outside-toplevel
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vectors = TfidfVectorizer().fit_transform(documents)
 
     graph_similarity = nx.Graph()
 
-    for i, user_i in enumerate(users):
-        for j, user_j in enumerate(users):
-            if i > j and pairwise_similarity[i, j] > threshold:
-                graph_similarity.add_edge(user_i.split('_')[0],
-                                          user_j.split('_')[0],
-                                          title=str(pairwise_similarity[i, j]))
+    for i, j, score in zip(*similar_pairs(vectors, threshold, top_k)):
+        graph_similarity.add_edge(users[j].split('_')[0],
+                                  users[i].split('_')[0],
+                                  title=str(score))
 
     return graph_similarity